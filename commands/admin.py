@@ -1,10 +1,11 @@
 # Admin Commands
 # Admin-only features: alllinks, videoonly mode
 
-from core.database import get_all_link_ids, add_video_only_group, remove_video_only_group, get_allowed_chats, is_video_only_group
-from commands.link_shortener import fetch_all_links_from_api
+from core.database import get_all_link_ids, add_video_only_group, remove_video_only_group, get_allowed_chats, is_video_only_group, get_all_mirrored_links
+from commands.link_shortener import collect_links_from_api
+from core.link_sync import is_link_mirror_ready
 from config.messages import get_message
-from core.api_requests import greenapi_send_message as send_message
+from core.api_requests import enqueue_send_message as send_message
 
 # Session management for videoonly command - tracks pending selections
 videoonly_sessions = {}  # {chat_id: {'action': 'enable'/'disable', 'groups': [list of groups]}}
@@ -12,7 +13,7 @@ videoonly_sessions = {}  # {chat_id: {'action': 'enable'/'disable', 'groups': [l
 
 
 def handle_alllinks_command(page=1):
-    # List all shortened links (admin only) by fetching from ice.bio API with pagination
+    # List all shortened links (admin only) from the local mirror (or ice.bio API) with pagination
     # Args: page (default 1)
     # Returns: formatted message string
     
@@ -22,26 +23,30 @@ def handle_alllinks_command(page=1):
     if not all_db_links:
         return get_message("alllinks_no_links")
     
-    # Fetch all links from ice.bio API
-    all_api_links = fetch_all_links_from_api()
-    
-    if all_api_links is None:
-        return get_message("alllinks_api_error")
-    
     # Create mapping of link_id to user_chat_id and password
     link_id_to_user = {item['link_id']: item['user_chat_id'] for item in all_db_links}
     link_id_to_password = {item['link_id']: item.get('password') for item in all_db_links}
     
-    # Filter to only show links in our database (convert API ids to string for comparison)
-    db_link_ids = [item['link_id'] for item in all_db_links]
-    filtered_links = [link for link in all_api_links if str(link.get('id')) in db_link_ids]
+    links_per_page = 5
+    
+    # Serve from the local mirror once it is synced, otherwise fall back to the ice.bio API
+    filtered_links = get_all_mirrored_links() if is_link_mirror_ready() else None
+    total_links = len(filtered_links) if filtered_links is not None else 0
+    
+    if filtered_links is None:
+        # Page through ice.bio only until the requested page is filled or all tracked links are found
+        filtered_links, complete = collect_links_from_api(set(link_id_to_user.keys()), needed=max(page, 1) * links_per_page)
+        
+        if filtered_links is None:
+            return get_message("alllinks_api_error")
+        
+        # Stopped early - the database knows how many links are tracked
+        total_links = len(filtered_links) if complete else max(len(filtered_links), len(link_id_to_user))
     
     if not filtered_links:
         return get_message("alllinks_no_links")
     
     # Pagination logic
-    links_per_page = 5
-    total_links = len(filtered_links)
     total_pages = (total_links + links_per_page - 1) // links_per_page
     
     # Validate page number
@@ -52,7 +57,7 @@ def handle_alllinks_command(page=1):
     
     # Calculate slice indices
     start_idx = (page - 1) * links_per_page
-    end_idx = min(start_idx + links_per_page, total_links)
+    end_idx = min(start_idx + links_per_page, len(filtered_links))
     
     # Get links for current page
     page_links = filtered_links[start_idx:end_idx]
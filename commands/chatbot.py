@@ -4,7 +4,7 @@
 
 import time
 from config.messages import get_message
-from core.api_requests import chatgpt_send_message
+from core.async_api_requests import chatgpt_send_message
 from core.logger import log_gpt_operation, log_api_error
 
 # ==================== SESSION MANAGEMENT ====================
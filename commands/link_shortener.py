@@ -2,27 +2,148 @@
 # Features: Shorten links with custom alias and password, view user links with stats
 
 import time
-from core.database import save_shortened_link, get_user_link_ids
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+from core.cache import SWRCache, TTLCache, SingleFlight
+from config.config import get_setting
+from core.database import (
+    save_shortened_link, get_user_link_ids, get_user_mirrored_links,
+    get_link_by_fingerprint, get_links_by_fingerprints, save_link_fingerprint, save_shortened_links_batch
+)
 from config.messages import get_message
-from core.api_requests import link_shorten_request, link_list_request, link_stats_request
+from core.api_requests import link_shorten_request, link_list_request, link_stats_request, with_request_deadline
+from core.link_sync import is_link_mirror_ready, mirror_new_link
 from core.logger import log_api_error, log_link_operation, log_db_operation
 
 # ==================== LINK SHORTENING ====================
 
+# Results of just-finished shortens per (user, fingerprint) - absorbs repeated sends within a short window
+_recent_shortens = TTLCache(ttl=get_setting('shortener', 'dedupe_window_seconds', 2), max_entries=500)
+
+# Concurrent identical shorten requests share one ice.bio call
+_shorten_flight = SingleFlight()
+
+# Ports that can be dropped from a URL without changing where it points
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    # Normalize a URL so trivially different spellings map to the same fingerprint
+    # Lowercases scheme and host, drops default ports; the query is kept as written
+    # (parameter order and repeated keys can matter to the target site)
+    
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        
+        if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{parts.port}"
+        if parts.username:
+            credentials = parts.username + (f":{parts.password}" if parts.password else '')
+            host = f"{credentials}@{host}"
+        
+        path = parts.path or '/'
+        
+        return urlunsplit((scheme, host, path, parts.query, parts.fragment))
+    except ValueError:
+        return url.strip()
+
+
+def url_fingerprint(url, custom_alias=None, password=None):
+    # Fingerprint of the normalized URL plus alias and password
+    raw = f"{normalize_url(url)}\n{custom_alias or ''}\n{password or ''}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def build_shorten_message(short_url, link_id, custom_alias=None, password=None, reused=False):
+    # Build success message with templates from messages.py
+    alias_info = get_message("shortener_alias_line", alias=custom_alias) if custom_alias else ""
+    password_info = get_message("shortener_password_line", password=password) if password else ""
+    
+    return get_message(
+        "shortener_existing" if reused else "shortener_success",
+        short_url=short_url,
+        alias_info=alias_info,
+        password_info=password_info,
+        link_id=link_id
+    )
+
+
+def _shorten_failure(result):
+    # Log a failed link_shorten_request and turn it into a reply
+    # Returns: dict with 'success' False, 'message' (full reply) and 'error' (short reason for bulk replies)
+    error_type = result.get('error_type')
+    
+    if error_type == 'timeout':
+        log_api_error('Link Shortener', 'timeout', 'Request timed out after 30 seconds')
+        message = get_message("shortener_timeout")
+    elif error_type == 'http_error':
+        log_api_error('Link Shortener', 'http_error', f"Status: {result.get('status_code')}")
+        message = get_message("shortener_api_error", error_message=f"HTTP {result.get('status_code')}")
+    elif error_type == 'incomplete_response':
+        log_api_error('Link Shortener', 'incomplete_response', f"Raw data: {result.get('raw_data')}")
+        message = get_message("shortener_api_error", error_message="Incomplete response from API")
+    elif error_type == 'api_error':
+        log_api_error('Link Shortener', 'api_error', 
+                      f"Code: {result.get('error_code')}, Message: {result.get('error_message')}")
+        message = get_message("shortener_api_error", error_message=result.get('error_message'))
+    elif error_type == 'connection_error':
+        log_api_error('Link Shortener', 'connection_error', result.get('error'))
+        message = get_message("shortener_connection_error")
+    else:
+        log_api_error('Link Shortener', 'unexpected_error', result.get('error'))
+        message = get_message("shortener_unexpected_error")
+    
+    error = result.get('error_message') or (result.get('error_type') or 'unknown error').replace('_', ' ')
+    return {
+        'success': False,
+        'message': message,
+        'error': error
+    }
+
+
 def shorten_link(user_id, url, custom_alias=None, password=None):
-    # Shorten a URL using ice.bio API
+    # Shorten a URL using ice.bio API, reusing the user's existing short link for the same URL
     # Args: user_id, url, custom_alias (optional), password (optional)
     # Returns: dict with 'success', 'message', 'short_url', 'link_id'
     
-    # Performance timing
-    start_time = time.perf_counter()
-    
     if not url.startswith(('http://', 'https://')):
         return {
             'success': False,
             'message': get_message("shortener_invalid_url")
         }
     
+    fingerprint = url_fingerprint(url, custom_alias, password)
+    key = (user_id, fingerprint)
+    
+    # Same request just completed - return the same result
+    recent = _recent_shortens.get(key)
+    if recent is not None:
+        return recent
+    
+    return _shorten_flight.do(key, lambda: _shorten_link_once(user_id, url, custom_alias, password, fingerprint))
+
+
+def _shorten_link_once(user_id, url, custom_alias, password, fingerprint):
+    # Look up the fingerprint index, then create a new short link only if needed
+    
+    # Performance timing
+    start_time = time.perf_counter()
+    
+    existing = get_link_by_fingerprint(user_id, fingerprint)
+    if existing:
+        print(f"⏱️  Reused existing short link in {(time.perf_counter() - start_time) * 1000:.2f}ms")
+        result = {
+            'success': True,
+            'message': build_shorten_message(existing['short_url'], existing['link_id'], custom_alias, password, reused=True),
+            'short_url': existing['short_url'],
+            'link_id': existing['link_id']
+        }
+        _recent_shortens.set((user_id, fingerprint), result)
+        return result
+    
     # Call API via centralized handler
     api_start = time.perf_counter()
     result = link_shorten_request(url, custom_alias, password)
@@ -30,46 +151,7 @@ def shorten_link(user_id, url, custom_alias=None, password=None):
     print(f"⏱️  Link Shortener API call took {api_duration:.2f}ms")
     
     if not result.get('success'):
-        # Handle different error types
-        error_type = result.get('error_type')
-        
-        if error_type == 'timeout':
-            log_api_error('Link Shortener', 'timeout', 'Request timed out after 30 seconds')
-            return {
-                'success': False,
-                'message': get_message("shortener_timeout")
-            }
-        elif error_type == 'http_error':
-            log_api_error('Link Shortener', 'http_error', f"Status: {result.get('status_code')}")
-            return {
-                'success': False,
-                'message': get_message("shortener_api_error", error_message=f"HTTP {result.get('status_code')}")
-            }
-        elif error_type == 'incomplete_response':
-            log_api_error('Link Shortener', 'incomplete_response', f"Raw data: {result.get('raw_data')}")
-            return {
-                'success': False,
-                'message': get_message("shortener_api_error", error_message="Incomplete response from API")
-            }
-        elif error_type == 'api_error':
-            log_api_error('Link Shortener', 'api_error', 
-                         f"Code: {result.get('error_code')}, Message: {result.get('error_message')}")
-            return {
-                'success': False,
-                'message': get_message("shortener_api_error", error_message=result.get('error_message'))
-            }
-        elif error_type == 'connection_error':
-            log_api_error('Link Shortener', 'connection_error', result.get('error'))
-            return {
-                'success': False,
-                'message': get_message("shortener_connection_error")
-            }
-        else:
-            log_api_error('Link Shortener', 'unexpected_error', result.get('error'))
-            return {
-                'success': False,
-                'message': get_message("shortener_unexpected_error")
-            }
+        return _shorten_failure(result)
     
     # Extract success data
     link_id = result.get('link_id')
@@ -79,6 +161,8 @@ def shorten_link(user_id, url, custom_alias=None, password=None):
     db_start = time.perf_counter()
     log_db_operation('link_saved', link_id=link_id, user=user_id)
     save_shortened_link(user_id, link_id, password)
+    save_link_fingerprint(user_id, fingerprint, link_id, short_url)
+    mirror_new_link(link_id, short_url, custom_alias)
     db_duration = (time.perf_counter() - db_start) * 1000
     print(f"⏱️  Database save took {db_duration:.2f}ms")
     
@@ -86,87 +170,273 @@ def shorten_link(user_id, url, custom_alias=None, password=None):
     
     # Build success message with templates from messages.py
     msg_start = time.perf_counter()
-    alias_info = get_message("shortener_alias_line", alias=custom_alias) if custom_alias else ""
-    password_info = get_message("shortener_password_line", password=password) if password else ""
-    
-    message = get_message(
-        "shortener_success",
-        short_url=short_url,
-        alias_info=alias_info,
-        password_info=password_info,
-        link_id=link_id
-    )
+    message = build_shorten_message(short_url, link_id, custom_alias, password)
     msg_duration = (time.perf_counter() - msg_start) * 1000
     print(f"⏱️  Message formatting took {msg_duration:.2f}ms")
     
     total_duration = (time.perf_counter() - start_time) * 1000
     print(f"⏱️  TOTAL link shortening took {total_duration:.2f}ms")
     
-    return {
+    result = {
         'success': True,
         'message': message,
         'short_url': short_url,
         'link_id': link_id
     }
+    _recent_shortens.set((user_id, fingerprint), result)
+    return result
 
 
-# ==================== LINK LISTING ====================
+# ==================== BULK SHORTENING ====================
+
+# Shared pool for bulk shortening - bounds concurrent ice.bio calls per worker
+_bulk_shorten_executor = ThreadPoolExecutor(
+    max_workers=get_setting('shortener', 'bulk_workers', 5),
+    thread_name_prefix='link-bulk'
+)
+
+
+def extract_urls(parts):
+    # Pick every http(s) URL out of the command arguments (order kept, duplicates removed)
+    urls = [part for part in parts if part.startswith(('http://', 'https://'))]
+    return list(dict.fromkeys(urls))
 
-def fetch_all_links_from_api():
-    # Fetch links from ice.bio API
-    # Returns: list of link objects or None on error
-    # Note: Reduced limit from 1000 to 200 for better performance
-    # Most users won't have more than 200 links, and this significantly speeds up the request
+
+def shorten_links_bulk(user_id, urls):
+    # Shorten many URLs concurrently and save the new links in one transaction
+    # Args: user_id, urls (list of str)
+    # Returns: dict with 'success', 'message'
     
-    log_link_operation('fetching')
+    # Performance timing
+    start_time = time.perf_counter()
     
-    # Call API via centralized handler (reduced from 1000 to 200 for performance)
-    result = link_list_request(limit=200, page=1)
+    max_urls = get_setting('shortener', 'bulk_max_urls', 20)
+    skipped = max(len(urls) - max_urls, 0)
+    urls = urls[:max_urls]
     
-    if not result.get('success'):
-        # Handle error
-        error_type = result.get('error_type')
-        
-        if error_type == 'http_error':
-            log_api_error('Link List', 'http_error', f"Status: {result.get('status_code')}")
-        elif error_type == 'api_error':
-            log_api_error('Link List', 'api_error', result.get('error_message'))
+    fingerprints = {url: url_fingerprint(url) for url in urls}
+    results = {}  # {url: {'link_id', 'short_url'} or {'error'}}
+    
+    # Reuse links created moments ago or already in the fingerprint index (one query for the batch)
+    known = get_links_by_fingerprints(user_id, [fp for fp in fingerprints.values() if _recent_shortens.get((user_id, fp)) is None])
+    for url, fingerprint in fingerprints.items():
+        existing = _recent_shortens.get((user_id, fingerprint)) or known.get(fingerprint)
+        if existing:
+            results[url] = {'link_id': existing['link_id'], 'short_url': existing['short_url']}
+    
+    # Create the rest concurrently (bounded pool)
+    # Each create joins _shorten_flight like a single .short, so the same URL is never created twice at once;
+    # only links this call created itself (led) are saved below - a joined .short saves its own
+    to_create = [url for url in urls if url not in results]
+    api_start = time.perf_counter()
+    created = []
+    led = set()
+    
+    def create(url):
+        def lead():
+            led.add(url)
+            result = link_shorten_request(url)
+            if not result.get('success'):
+                return _shorten_failure(result)
+            return {
+                'success': True,
+                'message': build_shorten_message(result.get('short_url'), result.get('link_id')),
+                'short_url': result.get('short_url'),
+                'link_id': result.get('link_id')
+            }
+        return _shorten_flight.do((user_id, fingerprints[url]), lead)
+    
+    for url, result in zip(to_create, _bulk_shorten_executor.map(with_request_deadline(create), to_create)):
+        if result.get('success'):
+            link = {
+                'link_id': result.get('link_id'),
+                'short_url': result.get('short_url'),
+                'fingerprint': fingerprints[url]
+            }
+            results[url] = link
+            if url in led:
+                created.append(link)
         else:
-            log_api_error('Link List', 'unexpected_error', result.get('error'))
-        
-        return None
+            results[url] = {'error': result.get('error') or 'unknown error'}
+    
+    print(f"⏱️  Bulk shortening API calls took {(time.perf_counter() - api_start) * 1000:.2f}ms for {len(to_create)} links")
+    
+    # Save the whole batch in one transaction
+    saved = True
+    if created:
+        db_start = time.perf_counter()
+        saved = save_shortened_links_batch(user_id, created)
+        print(f"⏱️  Bulk database save took {(time.perf_counter() - db_start) * 1000:.2f}ms")
+    
+    # Only links that reached the database are offered for reuse
+    if saved:
+        for link in created:
+            _recent_shortens.set((user_id, link['fingerprint']), {
+                'success': True,
+                'message': build_shorten_message(link['short_url'], link['link_id']),
+                'short_url': link['short_url'],
+                'link_id': link['link_id']
+            })
+    
+    # Build one consolidated reply
+    succeeded = sum(1 for result in results.values() if 'error' not in result)
+    message = get_message("shortener_bulk_header", succeeded=succeeded, total=len(urls))
+    
+    for number, url in enumerate(urls, 1):
+        result = results[url]
+        if 'error' in result:
+            message += get_message("shortener_bulk_item_failed", number=number, url=url, error_message=result['error'])
+        else:
+            message += get_message("shortener_bulk_item", number=number, url=url, short_url=result['short_url'], link_id=result['link_id'])
+    
+    if not saved:
+        message += get_message("shortener_bulk_save_failed")
+    
+    if skipped:
+        message += get_message("shortener_bulk_skipped", skipped=skipped, max_urls=max_urls)
+    
+    message += get_message("shortener_bulk_footer")
+    
+    print(f"⏱️  TOTAL bulk shortening took {(time.perf_counter() - start_time) * 1000:.2f}ms")
     
-    return result.get('links', [])
+    return {
+        'success': succeeded > 0,
+        'message': message
+    }
 
 
-def list_user_recent_links(user_id, page=1):
-    # List user's recent shortened links by fetching from ice.bio API with pagination
-    # Args: user_id, page (default 1)
-    # Returns: formatted message string
+# ==================== LINK LISTING ====================
+
+# Page size for lazy list paging - small pages let listings stop early
+LINK_LIST_PAGE_SIZE = 50
+
+
+def fetch_all_links_from_api(wanted_ids=None, page_size=LINK_LIST_PAGE_SIZE):
+    # Lazily page through the ice.bio link list (newest first) as a generator
+    # Args: wanted_ids (optional set of link ID strings) - only those links are yielded,
+    #       and paging stops as soon as every one of them has been found
+    # Yields: link objects; yields None once and stops if a page request fails
     
-    # Get user's link IDs with passwords from database
-    log_db_operation('link_query', chat_id=user_id)
-    user_link_data = get_user_link_ids(user_id)
+    log_link_operation('fetching')
     
-    if not user_link_data:
-        return get_message("mylinks_no_links")
+    remaining = set(wanted_ids) if wanted_ids is not None else None
+    page = 1
+    
+    while True:
+        # Call API via centralized handler
+        result = link_list_request(limit=page_size, page=page)
+        
+        if not result.get('success'):
+            # Handle error
+            error_type = result.get('error_type')
+            
+            if error_type == 'http_error':
+                log_api_error('Link List', 'http_error', f"Status: {result.get('status_code')}")
+            elif error_type == 'api_error':
+                log_api_error('Link List', 'api_error', result.get('error_message'))
+            else:
+                log_api_error('Link List', 'unexpected_error', result.get('error'))
+            
+            yield None
+            return
+        
+        links = result.get('links', [])
+        
+        for link in links:
+            if remaining is None:
+                yield link
+                continue
+            
+            link_id = str(link.get('id'))
+            if link_id in remaining:
+                remaining.discard(link_id)
+                yield link
+                
+                # Every owned link found - no need to request more pages
+                if not remaining:
+                    return
+        
+        # Short page means we reached the end of the list
+        if len(links) < page_size:
+            return
+        
+        page += 1
+
+
+def collect_links_from_api(wanted_ids, needed=None):
+    # Pull links from the lazy pager until all wanted IDs are found or `needed` links are collected
+    # Args: wanted_ids (set of link ID strings), needed (optional int)
+    # Returns: (links, complete) - complete is False when paging stopped early to fill a page
+    #          (None, False) if the API failed before any link was found
+    
+    links = []
+    
+    for link in fetch_all_links_from_api(wanted_ids):
+        if link is None:
+            # Keep what we already have if a later page failed
+            return (links, False) if links else (None, False)
+        
+        links.append(link)
+        
+        if needed and len(links) >= needed:
+            return links, False
     
-    # Fetch all links from ice.bio API
-    all_links = fetch_all_links_from_api()
+    return links, True
+
+
+# Per-link stats cache shared by .stats and live .mylinks pages
+# Fresh hits return immediately, stale hits return immediately and refresh in the background,
+# and concurrent misses for one link share a single ice.bio request
+_link_stats_cache = SWRCache(
+    fresh_ttl=get_setting('link_stats', 'fresh_ttl_seconds', 30),
+    stale_ttl=get_setting('link_stats', 'stale_ttl_seconds', 300),
+    max_entries=get_setting('link_stats', 'cache_max_entries', 1000),
+    should_cache=lambda result: result.get('success')
+)
+_link_stats_executor = ThreadPoolExecutor(
+    max_workers=get_setting('link_stats', 'page_workers', 5),
+    thread_name_prefix='link-stats'
+)
+
+
+def get_cached_link_stats(link_id):
+    # Fetch stats for one link through the stats cache
+    # Returns: link_stats_request result dict (only successful results are cached)
     
-    if all_links is None:
-        return get_message("mylinks_api_error")
+    link_id = str(link_id)
+    return _link_stats_cache.get_or_load(link_id, lambda: link_stats_request(link_id))
+
+
+def fetch_page_link_stats(link_ids):
+    # Fetch stats for every link on a page concurrently (cost is the slowest call, not the sum)
+    # Args: link_ids (list of str) - already in display order
+    # Returns: list of link objects in ice.bio list format; links that failed are skipped
     
-    # Filter to only show user's links (convert API ids to string for comparison)
-    user_links = [link for link in all_links if str(link.get('id')) in user_link_data.keys()]
+    results = list(_link_stats_executor.map(with_request_deadline(get_cached_link_stats), link_ids))
     
-    if not user_links:
-        return get_message("mylinks_no_links")
+    page_links = []
+    for link_id, result in zip(link_ids, results):
+        if not result.get('success'):
+            continue
+        
+        details = result.get('details', {})
+        stats_data = result.get('data', {})
+        page_links.append({
+            'id': details.get('id', link_id),
+            'alias': details.get('alias', ''),
+            'shorturl': details.get('shorturl', 'N/A'),
+            'clicks': stats_data.get('clicks', 0),
+            'date': details.get('date', 'N/A')
+        })
+    
+    return page_links
+
+
+def paginate(total_items, page, per_page):
+    # Clamp page number and compute slice indices
+    # Returns: (page, total_pages, start_idx, end_idx)
     
-    # Pagination logic
-    links_per_page = 5
-    total_links = len(user_links)
-    total_pages = (total_links + links_per_page - 1) // links_per_page
+    total_pages = max((total_items + per_page - 1) // per_page, 1)
     
     # Validate page number
     if page < 1:
@@ -175,11 +445,57 @@ def list_user_recent_links(user_id, page=1):
         page = total_pages
     
     # Calculate slice indices
-    start_idx = (page - 1) * links_per_page
-    end_idx = min(start_idx + links_per_page, total_links)
+    start_idx = (page - 1) * per_page
+    end_idx = min(start_idx + per_page, total_items)
+    
+    return page, total_pages, start_idx, end_idx
+
+
+def list_user_recent_links(user_id, page=1):
+    # List user's recent shortened links from the local mirror (or ice.bio API) with pagination
+    # Args: user_id, page (default 1)
+    # Returns: formatted message string
+    
+    # Get user's link IDs with passwords from database
+    log_db_operation('link_query', chat_id=user_id)
+    user_link_data = get_user_link_ids(user_id)
+    
+    if not user_link_data:
+        return get_message("mylinks_no_links")
     
-    # Get links for current page
-    page_links = user_links[start_idx:end_idx]
+    links_per_page = 5
+    
+    if get_setting('link_stats', 'live_page_clicks', False):
+        # Live mode: page through link IDs from the database and fetch fresh stats for the visible page only
+        total_links = len(user_link_data)
+        page, total_pages, start_idx, end_idx = paginate(total_links, page, links_per_page)
+        
+        page_links = fetch_page_link_stats(list(user_link_data.keys())[start_idx:end_idx])
+        
+        if not page_links:
+            return get_message("mylinks_api_error")
+    else:
+        # Serve from the local mirror once it is synced, otherwise fall back to the ice.bio API
+        user_links = get_user_mirrored_links(user_id) if is_link_mirror_ready() else None
+        total_links = len(user_links) if user_links is not None else 0
+        
+        if user_links is None:
+            # Page through ice.bio only until the requested page is filled or all user links are found
+            user_links, complete = collect_links_from_api(set(user_link_data.keys()), needed=max(page, 1) * links_per_page)
+            
+            if user_links is None:
+                return get_message("mylinks_api_error")
+            
+            # Stopped early - the database knows how many links the user owns
+            total_links = len(user_links) if complete else max(len(user_links), len(user_link_data))
+        
+        if not user_links:
+            return get_message("mylinks_no_links")
+        
+        page, total_pages, start_idx, end_idx = paginate(total_links, page, links_per_page)
+        
+        # Get links for current page
+        page_links = user_links[start_idx:min(end_idx, len(user_links))]
     
     # Build message using templates
     message = get_message("mylinks_header", count=total_links)
@@ -250,6 +566,23 @@ def handle_shortener_command(user_id, args):
     # Parse arguments: url [custom_alias] [password]
     parts = args.strip().split()
     
+    # Several URLs in one message - bulk mode (no alias/password)
+    urls = extract_urls(parts)
+    if len(urls) > 1:
+        # Alias and password only apply to a single link - say so rather than dropping them
+        if any(not part.startswith(('http://', 'https://')) for part in parts):
+            return {
+                'type': 'usage',
+                'message': get_message("shortener_bulk_no_alias")
+            }
+        
+        result = shorten_links_bulk(user_id, urls)
+        return {
+            'type': 'result',
+            'message': result.get('message'),
+            'success': result.get('success', False)
+        }
+    
     url = parts[0] if len(parts) > 0 else None
     custom_alias = parts[1] if len(parts) > 1 else None
     password = parts[2] if len(parts) > 2 else None
@@ -299,8 +632,8 @@ def get_link_stats(link_id):
     # Args: link_id (str or int)
     # Returns: formatted message string
     
-    # Fetch stats from API
-    result = link_stats_request(link_id)
+    # Fetch stats through the cache (calls the API only on a miss)
+    result = get_cached_link_stats(link_id)
     
     if not result.get('success'):
         # Handle different error types
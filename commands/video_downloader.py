@@ -3,20 +3,258 @@
 # Supported: TikTok, Instagram, YouTube, Facebook, Twitter and more
 
 import re
-from config.messages import get_message
-from core.api_requests import video_download_request
-from core.logger import log_api_error, log_video_operation
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config.config import get_setting
+from core.api_requests import short_link_expand_request, media_probe_request, with_request_deadline, deadline_expired
+from core.async_api_requests import video_download_request
+from core.cache import TTLCache, SingleFlight
+from core.logger import log_api_error, log_video_operation, log_video_cache_hit, log_video_platform_demoted
+
+# ==================== SUPPORTED PLATFORMS ====================
+# Links are matched against the supported domains before any upstream call, so docs, news and other
+# sites BatGPT can't resolve are dropped locally instead of costing a failed (up to 60s) request
+
+_platform_settings = {
+    'filter_enabled': get_setting('video_platforms', 'filter_enabled', True),
+    'window': get_setting('video_platforms', 'health_window', 20),
+    'min_attempts': get_setting('video_platforms', 'demote_min_attempts', 8),
+    'min_success_rate': get_setting('video_platforms', 'demote_below_success_rate', 0.2),
+    'demote_seconds': get_setting('video_platforms', 'demote_seconds', 3600),
+}
+
+# Failures that say something about the platform (BatGPT answered but couldn't resolve it, or hung on it)
+# rather than about BatGPT itself being unreachable
+PLATFORM_FAILURE_TYPES = {'api_failed', 'no_video_url', 'timeout'}
+
+_DOMAIN_KEY = ''  # trie node key holding the configured domain
+
+
+def _compile_domain_trie(domains):
+    # Suffix trie over reversed host labels: "vm.tiktok.com" -> com -> tiktok -> vm
+    root = {}
+    for domain in domains:
+        node = root
+        for label in reversed(domain.lower().strip('.').split('.')):
+            node = node.setdefault(label, {})
+        node[_DOMAIN_KEY] = domain.lower()
+    return root
+
+
+_platform_trie = _compile_domain_trie(get_setting('video_platforms', 'domains', []))
+
+
+def match_platform(url):
+    # Configured platform domain that a link's host equals or is a subdomain of
+    # Returns: the domain (e.g. "tiktok.com" for vm.tiktok.com) or None
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return None
+    
+    node = _platform_trie
+    for label in reversed(host.split('.')):
+        node = node.get(label)
+        if node is None:
+            return None
+        if _DOMAIN_KEY in node:
+            return node[_DOMAIN_KEY]
+    return None
+
+
+# Per-platform outcome history and demotions
+_platform_outcomes = {}  # {domain: deque of True/False, newest last}
+_platform_demoted_until = {}  # {domain: time.monotonic() when the demotion ends}
+_platform_lock = Lock()
+
+
+def platform_status(url):
+    # Whether a link should be sent upstream
+    # Generic short links (t.co) are matched on where they point, so only those leading to a video platform pass
+    # Returns: (domain, status) - status is 'supported', 'unsupported' or 'demoted'
+    if not _platform_settings['filter_enabled'] or not _platform_trie:
+        return None, 'supported'
+    
+    domain = match_platform(expand_short_link(url))
+    if domain is None:
+        return None, 'unsupported'
+    
+    with _platform_lock:
+        until = _platform_demoted_until.get(domain)
+        if until is not None:
+            if time.monotonic() < until:
+                return domain, 'demoted'
+            # Demotion over - start the host on a clean slate
+            del _platform_demoted_until[domain]
+            _platform_outcomes.pop(domain, None)
+    
+    return domain, 'supported'
+
+
+def record_platform_outcome(url, success, error_type=None):
+    # Track resolution results per platform and demote hosts whose recent success rate collapses
+    # Failures that don't point at the platform (BatGPT unreachable, our own deadline) aren't counted
+    if not success and (error_type not in PLATFORM_FAILURE_TYPES or deadline_expired()):
+        return
+    
+    domain = match_platform(expand_short_link(url))
+    if domain is None:
+        return
+    
+    with _platform_lock:
+        outcomes = _platform_outcomes.setdefault(domain, deque(maxlen=_platform_settings['window']))
+        outcomes.append(success)
+        
+        attempts = len(outcomes)
+        success_rate = sum(outcomes) / attempts
+        if attempts < _platform_settings['min_attempts'] or success_rate >= _platform_settings['min_success_rate']:
+            return
+        
+        _platform_demoted_until[domain] = time.monotonic() + _platform_settings['demote_seconds']
+    
+    log_video_platform_demoted(domain, success_rate, attempts, _platform_settings['demote_seconds'])
+
+
+def get_platform_stats():
+    # Recent success rate per platform and current demotions (for the health endpoint)
+    now = time.monotonic()
+    with _platform_lock:
+        return {
+            'success_rates': {
+                domain: round(sum(outcomes) / len(outcomes), 2)
+                for domain, outcomes in _platform_outcomes.items() if outcomes
+            },
+            'demoted': {
+                domain: round(until - now)
+                for domain, until in _platform_demoted_until.items() if until > now
+            }
+        }
+
+
+# ==================== URL CANONICALIZATION ====================
+
+# Query parameters that only track the share - they never change which video a link points to
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'igshid', 'igsh', 'si', 'feature', 'ref', 'ref_src', 'ref_url', 's', 't',
+    '_r', '_t', 'is_from_webapp', 'is_copy_url', 'sender_device', 'sender_web_id', 'share_app_id',
+    'share_item_id', 'share_link_id', 'social_sharing', 'tt_from', 'u_code', 'utm_id', 'mibextid', 'rdid'
+}
+TRACKING_PREFIXES = ('utm_',)
+
+# Hosts whose links are only redirects to the real post - expanded before caching
+SHORT_LINK_HOSTS = set(get_setting('video_cache', 'short_link_hosts', ['vm.tiktok.com', 'vt.tiktok.com', 'fb.watch', 't.co', 'pin.it']))
+
+# Short link -> expanded URL (short links don't change target, so these live much longer than media)
+_expanded_links = TTLCache(ttl=get_setting('video_cache', 'expansion_ttl_seconds', 86400), max_entries=2000)
+
+
+def expand_short_link(url):
+    # Expand a known short-link host to the URL it redirects to (cached)
+    # Returns: expanded URL, or the input URL when it isn't a short link or can't be expanded
+    
+    host = (urlsplit(url).hostname or '').lower()
+    if host == 'youtu.be':
+        # youtu.be/<id> is always youtube.com/watch?v=<id> - no request needed
+        video_id = urlsplit(url).path.strip('/')
+        return f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+    
+    if host not in SHORT_LINK_HOSTS:
+        return url
+    
+    cached = _expanded_links.get(url)
+    if cached:
+        return cached
+    
+    # Follow a few hops (some short links redirect to another short link first)
+    expanded = url
+    for _ in range(3):
+        result = short_link_expand_request(expanded)
+        if not result.get('success'):
+            break
+        expanded = result['url']
+        if (urlsplit(expanded).hostname or '').lower() not in SHORT_LINK_HOSTS:
+            break
+    
+    if expanded != url:
+        _expanded_links.set(url, expanded)
+    return expanded
+
+
+def canonical_video_url(url):
+    # Canonical form of a video link used as the cache key
+    # Expands short links, lowercases the host, drops www./m., tracking parameters and fragments
+    
+    url = expand_short_link(url.strip())
+    
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    ]
+    path = parts.path.rstrip('/') or '/'
+    
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+# ==================== RESOLVED MEDIA CACHE ====================
+
+# Canonical URL -> {'media_url', 'title', 'resolved_at'}
+# TTL stays under how long the platforms' signed CDN URLs remain valid
+_resolved_media = TTLCache(
+    ttl=get_setting('video_cache', 'media_ttl_seconds', 1800),
+    max_entries=get_setting('video_cache', 'max_entries', 500)
+)
+
+
+# Concurrent resolutions of the same canonical URL share one upstream call
+_video_flight = SingleFlight()
+
+
+def get_video_resolution_stats():
+    # Cache size, single-flight coalescing counters and platform health (for the health endpoint)
+    stats = _video_flight.stats()
+    stats['cached'] = len(_resolved_media)
+    stats['platforms'] = get_platform_stats()
+    return stats
+
 
 # ==================== VIDEO DOWNLOAD ====================
 
 def download_video(url):
-    # Download video from social media URL
-    # Returns: dict with 'success', 'media_url', 'title' or None on error
+    # Download video from social media URL (repeat links within the TTL cost no upstream call)
+    # Returns: dict with 'success', 'media_url', 'title', 'resolved_at', 'canonical_url', 'cached' or None on error
     
     log_video_operation('downloading')
     
+    canonical_url = canonical_video_url(url)
+    
+    cached = _resolved_media.get(canonical_url)
+    if cached:
+        log_video_cache_hit(cached['title'])
+        return {'success': True, 'canonical_url': canonical_url, 'cached': True, **cached}
+    
+    # Copies of the link forwarded at the same moment join the first one's resolution
+    return _video_flight.do(canonical_url, lambda: _resolve_video(url, canonical_url))
+
+
+def _resolve_video(url, canonical_url):
+    # Resolve the media URL upstream and cache it under the canonical URL
+    
     # Call API via centralized handler
     result = video_download_request(url)
+    record_platform_outcome(url, result.get('success'), result.get('error_type'))
     
     if not result.get('success'):
         # Handle different error types
@@ -42,19 +280,77 @@ def download_video(url):
         return None
     
     log_video_operation('sent', title=result.get('title'))
-    return result
+    
+    media = {
+        'media_url': result.get('media_url'),
+        'title': result.get('title'),
+        'resolved_at': time.time()
+    }
+    _resolved_media.set(canonical_url, media)
+    return {'success': True, 'canonical_url': canonical_url, 'cached': False, **media}
 
 
-# ==================== HELPER FUNCTIONS ====================
+def forget_resolved_video(canonical_url):
+    # Drop a cached resolution whose media URL stopped working (expired CDN link), so the next request resolves again
+    if canonical_url:
+        _resolved_media.delete(canonical_url)
+
+
+# ==================== MULTI-URL MESSAGES ====================
 
-def get_supported_platforms():
-    # Returns formatted text of supported platforms
-    return get_message("supported_platforms")
+# Resolves the links of one message side by side (separate from the hedging pool inside video_download_request)
+_batch_executor = ThreadPoolExecutor(
+    max_workers=get_setting('video_resolution', 'max_urls_per_message', 5),
+    thread_name_prefix='video-batch'
+)
 
 
-def extract_url(text):
-    # Extract URL from message text
+def start_video_downloads(urls):
+    # Start resolving several links at once, under the caller's request deadline
+    # Returns: list of Futures (download_video results) in the same order as urls
+    resolve = with_request_deadline(download_video)
+    return [_batch_executor.submit(resolve, url) for url in urls]
+
+
+# ==================== DELIVERY PATH ====================
+
+def choose_delivery_path(media_url):
+    # Probe the resolved media URL and pick how to deliver it, before any send is attempted
+    # Returns: (path, size_bytes) - path is 'url' (sendFileByUrl), 'upload' (relay through us),
+    #          'link' (send the link only) or 'gone' (404/410 - nothing to send); size_bytes is None when unknown
+    
+    if not get_setting('video_delivery', 'probe_enabled', True):
+        return 'url', None
+    
+    probe = media_probe_request(media_url)
+    
+    if not probe.get('success'):
+        # Gone for good - Green API won't fetch it and the link is dead too; anything else (timeouts, 403s) still gets a try
+        if probe.get('status_code') in (404, 410):
+            return 'gone', None
+        return 'url', None
+    
+    size = probe.get('size')
+    max_bytes = get_setting('video_delivery', 'max_file_mb', 100) * 1024 * 1024
+    relay_max_bytes = get_setting('video_delivery', 'relay_max_mb', 50) * 1024 * 1024
+    
+    # Over WhatsApp's limit, or a web page rather than a file
+    if size is not None and size > max_bytes:
+        return 'link', size
+    if probe.get('content_type', '').startswith('text/html'):
+        return 'link', size
+    
+    # CDN refused HEAD but served a plain ranged GET - Green API's fetch is likely to be refused too
+    if probe.get('method') == 'range' and size is not None and size <= relay_max_bytes:
+        return 'upload', size
+    
+    return 'url', size
+
+
+# ==================== HELPER FUNCTIONS ====================
+
+def extract_urls(text):
+    # Extract every URL from message text (order kept, duplicates removed)
     # Handles URLs even when WhatsApp includes embeds/thumbnails
     url_pattern = r'https?://[^\s\n]+'
-    urls = re.findall(url_pattern, text)
-    return urls[0] if urls else None
+    return list(dict.fromkeys(re.findall(url_pattern, text)))
@@ -1,10 +1,68 @@
 # WhatsApp Tools
 # Public features for WhatsApp number checking and contact info
-# Includes auto-detection for Pakistani numbers (11 digits starting with 0)
+# Numbers are validated and normalized locally (core/phone_numbers.py) - national numbers default to Pakistan
+# .checkwa accepts a pasted list of numbers (bulk mode: concurrent, rate limited, cached for a day)
 
-from core.api_requests import greenapi_check_whatsapp as check_whatsapp, greenapi_get_avatar as get_avatar, greenapi_get_contact_info as get_contact_info, greenapi_download_avatar_file as download_avatar_as_file
+from core.api_requests import greenapi_check_whatsapp as check_whatsapp, greenapi_get_avatar as get_avatar, greenapi_download_avatar as download_avatar
+from core.api_requests import TokenBucket, with_request_deadline, AVATAR_SPOOL_MAX_BYTES
+from config.config import get_setting
 from config.messages import get_message
+from core.cache import TTLCache, BlobCache
+from core.chat_metadata import get_chat_metadata
+from core.phone_numbers import normalize_phone_number
+from core.logger import log_greenapi_avatar_cache_hit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
 import re
+import time
+
+# ==================== AVATAR CACHE ====================
+
+# chat_id -> (urlAvatar, content digest); the image bytes are stored once per digest in _avatar_blobs
+_avatar_index = TTLCache(
+    ttl=get_setting('avatars', 'cache_ttl_seconds', 3600),
+    max_entries=get_setting('avatars', 'cache_max_entries', 1000)
+)
+_avatar_blobs = BlobCache(
+    ttl=get_setting('avatars', 'cache_ttl_seconds', 3600),
+    max_bytes=get_setting('avatars', 'cache_max_bytes', 16 * 1024 * 1024),
+    disk_dir=get_setting('avatars', 'cache_disk_dir', ''),
+    disk_max_bytes=get_setting('avatars', 'cache_disk_max_bytes', 100 * 1024 * 1024)
+)
+
+
+def get_cached_avatar(chat_id):
+    # Look up a cached avatar for a chat
+    # Returns: (avatar_url, in-memory file) or None on a miss
+    entry = _avatar_index.get(chat_id)
+    if not entry:
+        return None
+    
+    avatar_url, digest = entry
+    data = _avatar_blobs.get(digest)
+    if data is None:
+        _avatar_index.delete(chat_id)
+        return None
+    
+    log_greenapi_avatar_cache_hit(chat_id, len(data))
+    return avatar_url, io.BytesIO(data)
+
+
+def cache_avatar(chat_id, avatar_url, avatar_file):
+    # Store a freshly downloaded avatar, leaving avatar_file rewound for the upload
+    # An avatar whose spool rolled over to disk goes straight to the disk tier (if any) instead of memory
+    try:
+        digest = _avatar_blobs.put_file(avatar_file, memory_max_bytes=AVATAR_SPOOL_MAX_BYTES)
+    finally:
+        avatar_file.seek(0)
+    
+    if digest:
+        _avatar_index.set(chat_id, (avatar_url, digest))
+
+
+def get_avatar_cache_stats():
+    # Avatar cache size and hit counters (for the health endpoint)
+    return {'chats': len(_avatar_index), **_avatar_blobs.stats()}
 
 
 def extract_phone_number(text):
@@ -13,20 +71,54 @@ def extract_phone_number(text):
     return digits if digits else None
 
 
-def detect_pakistani_number(phone_input):
-    # Detect if it's a Pakistani number starting with 0 (11 digits)
-    # Returns: formatted number with country code or None
+def extract_phone_numbers(text):
+    # Pick every phone number out of a pasted list (order kept, duplicates left in)
+    # Arguments arrive space-joined, so a number written in groups ("+92 300 1234567", "0300 1234567")
+    # is rebuilt by joining a token with the ones after it - but only when the joined digits make a valid
+    # number (core/phone_numbers.py lengths); otherwise each token stays its own candidate
+    # A token that is already valid is never joined, and '+' always starts a new number
+    tokens = []
+    for token in re.split(r'[\s,;]+', text or ''):
+        if token and not re.search(r'[^\d+()\-.]', token) and extract_phone_number(token):
+            tokens.append(token)
     
-    digits = extract_phone_number(phone_input)
-    
-    if not digits:
-        return None
+    numbers = []
+    i = 0
+    while i < len(tokens):
+        end = i + 1
+        if not normalize_phone_number(tokens[i])['valid']:
+            # Shortest run of following groups that completes a valid number
+            digit_count = len(extract_phone_number(tokens[i]))
+            for j in range(i + 1, len(tokens)):
+                if tokens[j].startswith('+'):
+                    break
+                digit_count += len(extract_phone_number(tokens[j]))
+                if digit_count > 15:
+                    break
+                if normalize_phone_number(' '.join(tokens[i:j + 1]))['valid']:
+                    end = j + 1
+                    break
+        
+        numbers.append(' '.join(tokens[i:end]))
+        i = end
     
-    # If 11 digits starting with 0, assume Pakistani number
-    if len(digits) == 11 and digits.startswith('0'):
-        return '92' + digits[1:]  # Replace 0 with 92
+    return numbers
+
+
+def normalize_checkwa_number(phone_input):
+    # Number in international digits form for checkWhatsapp, or None when it can't be a valid number
+    return normalize_phone_number(phone_input)['number']
+
+
+def resolve_chat_id(identifier_input):
+    # Chat ID for what the user typed - chat IDs pass through, numbers are normalized first
+    # (national numbers get the default country code); unparseable numbers fall back to their digits
+    identifier_input = identifier_input.strip()
+    if '@' in identifier_input:
+        return identifier_input
     
-    return digits
+    phone_number = normalize_phone_number(identifier_input)['number']
+    return format_chat_id(phone_number if phone_number else identifier_input)
 
 
 def format_chat_id(identifier):
@@ -43,7 +135,7 @@ def format_chat_id(identifier):
 
 def handle_checkwhatsapp(phone_input):
     # Check if a phone number has WhatsApp
-    # Auto-detects Pakistani numbers (11 digits starting with 0)
+    # National numbers (leading 0) are read as the default country's (Pakistan unless configured)
     # Returns: formatted response message
     
     if not phone_input or phone_input.strip() == '':
@@ -52,32 +144,33 @@ def handle_checkwhatsapp(phone_input):
             'message': get_message("checkwa_usage")
         }
     
-    phone_number = detect_pakistani_number(phone_input)
+    # Validate locally - impossible numbers never reach checkWhatsapp
+    normalized = normalize_phone_number(phone_input)
+    original_digits = extract_phone_number(phone_input)
     
-    if not phone_number:
+    if normalized['error'] == 'too_short':
         return {
             'type': 'result',
-            'message': get_message("checkwa_invalid_number")
+            'message': get_message("checkwa_number_too_short")
         }
     
-    # Validate length
-    if len(phone_number) < 10:
+    # National number (leading 0) that doesn't fit the default country - needs a country code
+    if normalized['error'] == 'needs_country_code':
         return {
             'type': 'result',
-            'message': get_message("checkwa_number_too_short")
+            'message': get_message("checkwa_needs_country_code", number=original_digits)
         }
     
-    # Check if number starts with 0 and is not 11 digits (needs country code)
-    original_digits = extract_phone_number(phone_input)
-    if original_digits and original_digits.startswith('0') and len(original_digits) != 11:
+    if not normalized['valid']:
         return {
             'type': 'result',
-            'message': get_message("checkwa_needs_country_code", number=original_digits)
+            'message': get_message("checkwa_invalid_number")
         }
     
-    result = check_whatsapp(phone_number)
+    phone_number = normalized['number']
+    exists = check_whatsapp_cached(phone_number)
     
-    if not result:
+    if exists is None:
         # Check if original input started with 0
         if original_digits and original_digits.startswith('0'):
             return {
@@ -90,8 +183,6 @@ def handle_checkwhatsapp(phone_input):
                 'message': get_message("checkwa_error")
             }
     
-    exists = result.get('existsWhatsapp', False)
-    
     # Determine display format: preserve original input if it started with 0, otherwise use + prefix
     if original_digits and original_digits.startswith('0'):
         # Show original format for numbers starting with 0
@@ -120,10 +211,127 @@ def handle_checkwhatsapp(phone_input):
             }
 
 
+# ==================== BULK WHATSAPP CHECK ====================
+
+# Number -> has WhatsApp; registrations rarely change, so results are kept for a day
+_checkwa_results = TTLCache(
+    ttl=get_setting('checkwa', 'cache_ttl_seconds', 86400),
+    max_entries=get_setting('checkwa', 'cache_max_entries', 50000)
+)
+
+# Bulk checks run on a small pool, paced by a token bucket so a 500-number list doesn't trip Green API throttling
+_checkwa_executor = ThreadPoolExecutor(
+    max_workers=get_setting('checkwa', 'bulk_workers', 5),
+    thread_name_prefix='checkwa-bulk'
+)
+_checkwa_bucket = TokenBucket(
+    get_setting('checkwa', 'rate_per_second', 5),
+    get_setting('checkwa', 'burst', 5)
+)
+
+
+def check_whatsapp_cached(phone_number, rate_limited=False):
+    # Check one normalized number, answering from the day-long cache when possible
+    # rate_limited: wait for the bulk token bucket before calling Green API
+    # Returns: True / False, or None if the check failed (failures aren't cached)
+    cached = _checkwa_results.get(phone_number)
+    if cached is not None:
+        return cached
+    
+    if rate_limited:
+        _checkwa_bucket.acquire()
+    
+    result = check_whatsapp(phone_number)
+    if not result:
+        return None
+    
+    exists = bool(result.get('existsWhatsapp', False))
+    _checkwa_results.set(phone_number, exists)
+    return exists
+
+
+def _format_number_list(numbers):
+    return '\n'.join(f"+{number}" for number in numbers)
+
+
+def handle_checkwhatsapp_bulk(numbers, on_progress=None):
+    # Check many numbers concurrently under the bulk rate limit
+    # Args: numbers (raw strings from extract_phone_numbers), on_progress (message -> None, optional)
+    # Returns: dict with 'type', 'message' (one compact summary)
+    
+    # Performance timing
+    start_time = time.perf_counter()
+    
+    max_numbers = get_setting('checkwa', 'bulk_max_numbers', 500)
+    skipped = max(len(numbers) - max_numbers, 0)
+    numbers = numbers[:max_numbers]
+    
+    # Normalize first, so "0300 1234567" and "+92 300 1234567" are checked once
+    invalid = []
+    to_check = {}  # {normalized number: raw input}
+    for raw in numbers:
+        normalized = normalize_checkwa_number(raw)
+        if normalized is None:
+            invalid.append(raw)
+        else:
+            to_check.setdefault(normalized, raw)
+    duplicates = len(numbers) - len(invalid) - len(to_check)
+    
+    total = len(to_check)
+    if on_progress and total:
+        on_progress(get_message("checkwa_bulk_started", total=total))
+    
+    results = {}
+    progress_min = get_setting('checkwa', 'progress_min_numbers', 50)
+    next_step = 25
+    
+    check = with_request_deadline(lambda number: check_whatsapp_cached(number, rate_limited=True))
+    futures = {_checkwa_executor.submit(check, number): number for number in to_check}
+    
+    for done, future in enumerate(as_completed(futures), 1):
+        try:
+            results[futures[future]] = future.result()
+        except Exception:
+            results[futures[future]] = None
+        
+        # Progress every 25% on long lists (the summary covers the last step)
+        percent = done * 100 // total
+        if on_progress and total >= progress_min and done < total and percent >= next_step:
+            on_progress(get_message("checkwa_bulk_progress", done=done, total=total))
+            while next_step <= percent:
+                next_step += 25
+    
+    found = [number for number in to_check if results[number] is True]
+    not_found = [number for number in to_check if results[number] is False]
+    failed = [number for number in to_check if results[number] is None]
+    
+    # Build one consolidated reply
+    message = get_message("checkwa_bulk_header", found=len(found), total=total)
+    if found:
+        message += get_message("checkwa_bulk_found", count=len(found), numbers=_format_number_list(found))
+    if not_found:
+        message += get_message("checkwa_bulk_not_found", count=len(not_found), numbers=_format_number_list(not_found))
+    if failed:
+        message += get_message("checkwa_bulk_failed", count=len(failed), numbers=_format_number_list(failed))
+    if invalid:
+        message += get_message("checkwa_bulk_invalid", count=len(invalid), numbers='\n'.join(invalid))
+    if duplicates:
+        message += get_message("checkwa_bulk_duplicates", duplicates=duplicates)
+    if skipped:
+        message += get_message("checkwa_bulk_skipped", skipped=skipped, max_numbers=max_numbers)
+    
+    print(f"⏱️  Bulk WhatsApp check took {(time.perf_counter() - start_time) * 1000:.2f}ms for {total} numbers")
+    
+    return {
+        'type': 'result',
+        'message': message.rstrip()
+    }
+
+
 def handle_getavatar(identifier_input):
     # Get avatar for a user or group
     # Sends avatar as file, not URL
-    # Returns: dict with 'type', 'message', optional 'file_path'
+    # Returns: dict with 'type', 'message', optional 'file' (in-memory avatar - the caller closes it)
     
     if not identifier_input or identifier_input.strip() == '':
         return {
@@ -131,9 +339,18 @@ def handle_getavatar(identifier_input):
             'message': get_message("avatar_usage")
         }
     
-    # Detect Pakistani number if applicable
-    phone_number = detect_pakistani_number(identifier_input)
-    chat_id = format_chat_id(phone_number if phone_number else identifier_input)
+    chat_id = resolve_chat_id(identifier_input)
+    
+    # Cache hit goes straight to upload - no getAvatar or CDN round trip
+    cached = get_cached_avatar(chat_id)
+    if cached:
+        avatar_url, avatar_file = cached
+        return {
+            'type': 'result',
+            'message': get_message("avatar_found"),
+            'avatar_url': avatar_url,
+            'file': avatar_file
+        }
     
     result = get_avatar(chat_id)
     
@@ -146,15 +363,16 @@ def handle_getavatar(identifier_input):
     avatar_url = result.get('urlAvatar')
     
     if avatar_url:
-        # Download avatar as file
-        file_path = download_avatar_as_file(avatar_url, chat_id)
+        # Download avatar into memory, ready to upload
+        avatar_file = download_avatar(avatar_url)
         
-        if file_path:
+        if avatar_file:
+            cache_avatar(chat_id, avatar_url, avatar_file)
             return {
                 'type': 'result',
                 'message': get_message("avatar_found"),
                 'avatar_url': avatar_url,
-                'file_path': file_path
+                'file': avatar_file
             }
         else:
             # Fallback to URL if download fails
@@ -178,17 +396,14 @@ def handle_getcontactinfo(identifier_input):
     if not identifier_input or identifier_input.strip() == '':
         return get_message("contactinfo_usage")
     
-    # Detect Pakistani number if applicable
-    phone_number = detect_pakistani_number(identifier_input)
-    chat_id = format_chat_id(phone_number if phone_number else identifier_input)
+    chat_id = resolve_chat_id(identifier_input)
     
-    result = get_contact_info(chat_id)
+    metadata = get_chat_metadata(chat_id, with_avatar=True)
     
-    if not result:
+    if not metadata:
         return get_message("contactinfo_error")
     
-    name = result.get('name', 'N/A')
-    avatar = result.get('avatar', 'No avatar')
+    name = metadata['name'] if metadata['name'] is not None else 'N/A'
     
     # Extract phone number for wa.me link
     phone_only = chat_id.replace('@c.us', '').replace('@g.us', '')
@@ -199,9 +414,10 @@ def handle_getcontactinfo(identifier_input):
     response += get_message("contactinfo_whatsapp", wa_me_link=wa_me_link)
     response += get_message("contactinfo_name", name=name)
     
-    if avatar and avatar != 'No avatar':
+    # has_avatar is None when a group's avatar couldn't be looked up - say nothing rather than guess
+    if metadata['has_avatar']:
         response += get_message("contactinfo_has_avatar")
-    else:
+    elif metadata['has_avatar'] is not None:
         response += get_message("contactinfo_no_avatar")
     
     return response
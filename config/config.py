@@ -35,6 +35,13 @@ def show_raw_webhook_logs():
     return settings.get('features', {}).get('raw_webhook_logging', False)
 
 
+def get_setting(section, key, default=None):
+    # Read a single tunable from settings.json (e.g. get_setting('link_mirror', 'page_size', 100))
+    # Returns default when the section or key is missing
+    settings = load_settings()
+    return settings.get(section, {}).get(key, default)
+
+
 def get_prefix():
     # Returns the command prefix from commands.json
     try:
@@ -163,6 +163,33 @@ _Type *.menu* to see how to use these features!_"""
         "_Please try again or use a different link_"
     ),
     
+    # Download failure for one link when a message had several
+    "video_download_failed_url": (
+        "*❌ Download Failed*\n\n"
+        "{url}\n\n"
+        "_The video may be private or the platform temporarily unavailable_"
+    ),
+    
+    # Link to a site the video downloader doesn't support (dropped without an API call)
+    "video_unsupported_platform": (
+        "*❌ Unsupported Link*\n\n"
+        "Videos can't be downloaded from this site.\n\n"
+        "*Supported:*\n"
+        "TikTok, Instagram, YouTube, Facebook, Twitter & more"
+    ),
+    
+    # Link to a platform whose downloads have been failing (temporarily skipped)
+    "video_platform_unavailable": (
+        "*⚠️ Downloads Unavailable*\n\n"
+        "Downloads from {domain} are failing right now.\n\n"
+        "_Please try again later_"
+    ),
+    
+    # Note when a message had more video links than are downloaded at once
+    "video_urls_skipped": (
+        "⚠️ _{skipped} more link(s) skipped - up to {max_urls} videos per message_"
+    ),
+    
     # Usage instructions for video download command
     "download_usage": (
         "📥 *Video Downloader*\n\n"
@@ -185,6 +212,14 @@ _Type *.menu* to see how to use these features!_"""
         "_Auto-send failed, but you can download from the link above_"
     ),
     
+    # Link-only delivery when the file is over WhatsApp's size limit
+    "video_too_large": (
+        "*📦 Video Too Large*\n\n"
+        "This video is {size_mb} MB - over WhatsApp's {limit_mb} MB limit.\n\n"
+        "*Download link:*\n"
+        "{video_url}"
+    ),
+    
     # List of platforms supported for video downloads
     "supported_platforms": (
         "*Supported Platforms*\n"
@@ -207,6 +242,9 @@ _Shortens with a custom alias._
 - *_.short <url> <custom_alias> <password>_*
 _Shortens with custom alias & password._
 
+- *_.short <url1> <url2> <url3> ..._*
+_Shortens several links at once._
+
 🚀 _Easily create, customize, and manage your links — all with SnapX!_"""
     ),
     
@@ -226,6 +264,58 @@ _Shortens with custom alias & password._
         "_Use_ *_.stats {link_id}_* _to view detailed statistics_"
     ),
     
+    # Message when the same URL (with the same alias and password) was already shortened by this user
+    "shortener_existing": (
+        "♻️ *Link Already Shortened*\n\n"
+        "🔗 *Short URL:* {short_url}\n"
+        "{alias_info}"
+        "{password_info}"
+        "🆔 *Link ID:* {link_id}\n\n"
+        "_Use_ *_.stats {link_id}_* _to view detailed statistics_"
+    ),
+    
+    # Header for bulk shortening reply (several URLs in one message)
+    "shortener_bulk_header": (
+        "✅ *{succeeded} of {total} Links Shortened*\n\n"
+    ),
+    
+    # One successfully shortened link in a bulk reply
+    "shortener_bulk_item": (
+        "*{number}.* 🔗 {short_url}\n"
+        "_{url}_\n"
+        "🆔 *Link ID:* {link_id}\n\n"
+    ),
+    
+    # One failed link in a bulk reply
+    "shortener_bulk_item_failed": (
+        "*{number}.* ❌ _{url}_\n"
+        "{error_message}\n\n"
+    ),
+    
+    # Note when the new links of a bulk request couldn't be saved to the database
+    "shortener_bulk_save_failed": (
+        "⚠️ _The new links were created but couldn't be saved, so they won't appear in_ *_.mylinks_*\n\n"
+    ),
+    
+    # Note when a bulk message had more URLs than allowed
+    "shortener_bulk_skipped": (
+        "⚠️ _{skipped} more link(s) skipped - up to {max_urls} links per message_\n\n"
+    ),
+    
+    # Bulk shortening given an alias or password (they only work with one link)
+    "shortener_bulk_no_alias": (
+        "❌ *Alias and password need a single link*\n\n"
+        "Custom aliases and passwords can't be used when shortening several links at once.\n\n"
+        "*Usage:*\n"
+        "_.short <url> <custom_alias> <password>_\n"
+        "_.short <url1> <url2> <url3> ..._"
+    ),
+    
+    # Footer for bulk shortening reply
+    "shortener_bulk_footer": (
+        "_Use_ *_.mylinks_* _to view all your links_"
+    ),
+    
     # Template for alias info line when custom alias is provided
     "shortener_alias_line": (
         "🏷️ *Alias:* {alias}\n"
@@ -584,10 +674,12 @@ _Shortens with custom alias & password._
         "📱 *Check WhatsApp Status*\n\n"
         "*Usage:*\n"
         "_.checkwhatsapp <number>_\n"
-        "_.checkwa <number>_\n\n"
+        "_.checkwa <number>_\n"
+        "_.checkwa <number> <number> ..._\n\n"
         "*Examples:*\n"
-        "_.checkwa 923001234567_\n\n"
-        "_Check if a number has WhatsApp_"
+        "_.checkwa 923001234567_\n"
+        "_.checkwa 923001234567, 03011234567, +92 302 1234567_\n\n"
+        "_Check if a number has WhatsApp - paste a whole list to check up to 500 at once_"
     ),
     
     # Error message for invalid phone number format
@@ -649,6 +741,57 @@ _Shortens with custom alias & password._
         "💡 _If this was a Pakistani number, try with country code: .checkwa 92{suggestion}_"
     ),
     
+    # Sent when a bulk check starts (several numbers in one message)
+    "checkwa_bulk_started": (
+        "⏳ *Checking {total} numbers...*\n\n"
+        "_Results will follow in one message_"
+    ),
+    
+    # Progress update during a long bulk check
+    "checkwa_bulk_progress": (
+        "⏳ _Checked {done} of {total} numbers..._"
+    ),
+    
+    # Header for the bulk check summary
+    "checkwa_bulk_header": (
+        "📱 *WhatsApp Check*\n\n"
+        "*{found} of {total}* numbers have WhatsApp\n\n"
+    ),
+    
+    # Numbers with WhatsApp in a bulk summary
+    "checkwa_bulk_found": (
+        "✅ *On WhatsApp ({count}):*\n"
+        "{numbers}\n\n"
+    ),
+    
+    # Numbers without WhatsApp in a bulk summary
+    "checkwa_bulk_not_found": (
+        "❌ *Not on WhatsApp ({count}):*\n"
+        "{numbers}\n\n"
+    ),
+    
+    # Numbers whose check failed in a bulk summary
+    "checkwa_bulk_failed": (
+        "⚠️ *Could not check ({count}):*\n"
+        "{numbers}\n\n"
+    ),
+    
+    # Inputs that can't be full phone numbers (never sent to WhatsApp)
+    "checkwa_bulk_invalid": (
+        "🚫 *Invalid ({count}):*\n"
+        "{numbers}\n\n"
+    ),
+    
+    # Note when the list repeated numbers
+    "checkwa_bulk_duplicates": (
+        "_{duplicates} duplicate number(s) checked once_\n"
+    ),
+    
+    # Note when a bulk message had more numbers than allowed
+    "checkwa_bulk_skipped": (
+        "⚠️ _{skipped} more number(s) skipped - up to {max_numbers} numbers per message_\n"
+    ),
+    
     # Usage instructions for getting user avatar
     "avatar_usage": (
         "👤 *Get Avatar*\n\n"
@@ -1,12 +1,25 @@
 # External API Requests Handler
 # Centralizes all external API calls (ChatGPT, Video Downloader, Link Shortener, Green API)
 # Only database calls remain in database.py
+#
+# Each API call is described by a request plan (endpoint, method, url, request kwargs,
+# parse and error handlers). execute_plan() runs a plan over the pooled sync sessions below;
+# core/async_api_requests.py runs the ChatGPT and video resolution plans over an async client.
 
 import os
+import time
 import requests
 import tempfile
-from threading import Lock
-from urllib.parse import quote
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock, Condition, Thread
+from urllib.parse import quote, urlsplit, urljoin
+from requests.adapters import HTTPAdapter
+
+from config.config import get_setting
+from core.multipart import MultipartFileEncoder
 
 # Import logging functions
 from core.logger import (
@@ -15,10 +28,510 @@ from core.logger import (
     log_link_shorten_request, log_link_shorten_response, log_link_error,
     log_link_list_request, log_link_list_response,
     log_link_stats_request, log_link_stats_response,
-    log_greenapi_send, log_greenapi_response,
+    log_greenapi_send, log_greenapi_response, log_greenapi_send_latency,
+    log_circuit_state, log_upload_progress, log_upload_done,
     log_raw_request, log_raw_response
 )
 
+# ==================== HTTP SESSIONS ====================
+
+# Default timeout (seconds) per endpoint - used unless a call passes its own
+DEFAULT_TIMEOUTS = {
+    'chatgpt': 30,
+    'video_download': 60,
+    'short_link_expand': 10,
+    'media_probe': 10,
+    'media_relay': 60,
+    'link_shorten': 30,
+    'link_list': 30,
+    'link_stats': 30,
+    'greenapi_send_message': 30,
+    'greenapi_send_file_url': 60,
+    'greenapi_send_file_upload': 60,
+    'greenapi_forward_messages': 30,
+    'greenapi_send_poll': 30,
+    'greenapi_send_location': 30,
+    'greenapi_send_contact': 30,
+    'greenapi_get_settings': 30,
+    'greenapi_check_whatsapp': 30,
+    'greenapi_get_avatar': 30,
+    'greenapi_get_contact_info': 30,
+    'greenapi_get_group_data': 30,
+    'avatar_download': 30,
+}
+
+# Endpoints that talk to arbitrary third-party hosts (video CDNs, short-link redirectors, avatar servers)
+# instead of a fixed upstream API. They share one session and have no circuit breaker.
+THIRD_PARTY_ENDPOINTS = ('short_link_expand', 'media_probe', 'media_relay', 'avatar_download')
+THIRD_PARTY_SESSION_KEY = 'third-party'
+
+# One keep-alive session per upstream host ({subdomain}.api.green-api.com, batgpt.vercel.app, ice.bio, ...)
+# plus the shared third-party session, whose adapter keeps pools for at most http.third_party_hosts
+# hosts (least recently used pool is dropped)
+_sessions = {}  # {host or THIRD_PARTY_SESSION_KEY: requests.Session}
+_sessions_lock = Lock()
+
+
+def _get_session(url, endpoint=None):
+    # Get (or create) the pooled session for this URL's host (the shared one for third-party endpoints)
+    if endpoint in THIRD_PARTY_ENDPOINTS:
+        host = THIRD_PARTY_SESSION_KEY
+        pool_connections = get_setting('http', 'third_party_hosts', 20)
+    else:
+        host = urlsplit(url).netloc
+        pool_connections = 1
+    
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            # Pool size covers the webhook thread plus the background/bulk thread pools
+            pool_size = get_setting('http', 'pool_size', 10)
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+        return session
+
+
+def http_request(endpoint, method, url, **kwargs):
+    # Send a request over the pooled session for the URL's host
+    # endpoint: key in DEFAULT_TIMEOUTS - picks the default timeout (capped by the request deadline)
+    kwargs['timeout'] = call_timeout(endpoint, kwargs.get('timeout'))
+    return _get_session(url, endpoint).request(method, url, **kwargs)
+
+
+def get_connection_stats():
+    # Connection reuse per upstream host (third-party hosts are summed under THIRD_PARTY_SESSION_KEY)
+    # Returns: {host: {'requests': n, 'connections': n, 'reused': n}}
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+    
+    stats = {}
+    for host, session in sessions:
+        total_requests = 0
+        total_connections = 0
+        
+        for prefix in ('https://', 'http://'):
+            pools = session.get_adapter(prefix + host).poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    total_connections += pool.num_connections
+        
+        stats[host] = {
+            'requests': total_requests,
+            'connections': total_connections,
+            'reused': max(total_requests - total_connections, 0)
+        }
+    
+    return stats
+
+
+# ==================== ADAPTIVE TIMEOUTS ====================
+# Each endpoint keeps a rolling window of recent call durations. Once it has enough samples its
+# timeout becomes percentile x multiplier, clamped between floor_seconds and the DEFAULT_TIMEOUTS cap,
+# so a stuck ice.bio call fails in seconds while slow video resolutions still get up to 60s.
+# Timed-out calls are recorded at the time they waited, which pushes the timeout back up when needed.
+# Endpoints in FIXED_TIMEOUT_ENDPOINTS always get their DEFAULT_TIMEOUTS value: their duration grows with
+# the file size (a short clip's latency says nothing about a 90 MB video), or they create something
+# upstream that a client-side timeout plus retry would create twice.
+
+FIXED_TIMEOUT_ENDPOINTS = (
+    # Size-dependent
+    'greenapi_send_file_url', 'greenapi_send_file_upload', 'media_relay',
+    # Non-idempotent
+    'link_shorten', 'greenapi_send_message', 'greenapi_forward_messages',
+    'greenapi_send_poll', 'greenapi_send_location', 'greenapi_send_contact',
+)
+
+_adaptive_settings = {
+    'enabled': get_setting('adaptive_timeouts', 'enabled', True),
+    'percentile': get_setting('adaptive_timeouts', 'percentile', 99),
+    'multiplier': get_setting('adaptive_timeouts', 'multiplier', 3),
+    'floor_seconds': get_setting('adaptive_timeouts', 'floor_seconds', 2),
+    'min_samples': get_setting('adaptive_timeouts', 'min_samples', 20),
+    'window': get_setting('adaptive_timeouts', 'window', 200),
+}
+
+_latencies = {}  # {endpoint: deque of recent durations in seconds}
+_latencies_lock = Lock()
+
+
+def record_latency(endpoint, seconds):
+    # Add one call duration to the endpoint's rolling window
+    with _latencies_lock:
+        samples = _latencies.get(endpoint)
+        if samples is None:
+            samples = deque(maxlen=_adaptive_settings['window'])
+            _latencies[endpoint] = samples
+        samples.append(seconds)
+
+
+def _percentile(sorted_samples, percentile):
+    # Nearest-rank percentile of an already sorted list
+    index = max(int(round(percentile / 100 * len(sorted_samples))) - 1, 0)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+
+def latency_percentile(endpoint, percentile):
+    # Observed latency percentile in seconds, or None until the endpoint has min_samples
+    with _latencies_lock:
+        samples = sorted(_latencies.get(endpoint, ()))
+    
+    if len(samples) < _adaptive_settings['min_samples']:
+        return None
+    return _percentile(samples, percentile)
+
+
+def adaptive_timeout(endpoint):
+    # Timeout for the endpoint from its observed latency (falls back to the fixed default)
+    cap = DEFAULT_TIMEOUTS.get(endpoint, 30)
+    if not _adaptive_settings['enabled'] or endpoint in FIXED_TIMEOUT_ENDPOINTS:
+        return cap
+    
+    with _latencies_lock:
+        samples = sorted(_latencies.get(endpoint, ()))
+    
+    if len(samples) < _adaptive_settings['min_samples']:
+        return cap
+    
+    timeout = _percentile(samples, _adaptive_settings['percentile']) * _adaptive_settings['multiplier']
+    return min(max(timeout, _adaptive_settings['floor_seconds']), cap)
+
+
+def get_timeout_stats():
+    # Observed latency and current timeout per endpoint (for the health endpoint)
+    with _latencies_lock:
+        windows = {endpoint: sorted(samples) for endpoint, samples in _latencies.items()}
+    
+    stats = {}
+    for endpoint, samples in windows.items():
+        if not samples:
+            continue
+        stats[endpoint] = {
+            'samples': len(samples),
+            'p50_ms': round(_percentile(samples, 50) * 1000),
+            'p99_ms': round(_percentile(samples, 99) * 1000),
+            'timeout_s': round(adaptive_timeout(endpoint), 1)
+        }
+    return stats
+
+
+# ==================== REQUEST DEADLINES ====================
+# Each webhook gets one time budget (created in core/main.py, activated in core/bot.py).
+# Upstream calls made while handling it use min(their default timeout, time left); once the
+# budget is spent they are skipped and reported through the endpoint's usual timeout error.
+
+_request_deadline = ContextVar('request_deadline', default=None)  # time.monotonic() value or None
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    # The request's time budget ran out before this call could be made
+    pass
+
+
+def new_request_deadline(budget_seconds):
+    # Absolute deadline budget_seconds from now
+    return time.monotonic() + budget_seconds
+
+
+@contextmanager
+def request_deadline(deadline):
+    # Run the enclosed calls under an absolute deadline (None = no deadline)
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def get_request_deadline():
+    return _request_deadline.get()
+
+
+def time_remaining():
+    # Seconds left in the current request's budget, or None when there is no deadline
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def deadline_expired():
+    remaining = time_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def with_request_deadline(fn):
+    # Wrap fn so it runs under the caller's deadline on another thread (thread pools, workers)
+    deadline = _request_deadline.get()
+    
+    def run(*args, **kwargs):
+        with request_deadline(deadline):
+            return fn(*args, **kwargs)
+    
+    return run
+
+
+def call_timeout(endpoint, timeout=None):
+    # Timeout for one upstream call: min(explicit or adaptive timeout, time left in the request)
+    # Raises DeadlineExceeded when the budget is already spent
+    if timeout is None:
+        timeout = adaptive_timeout(endpoint)
+    
+    remaining = time_remaining()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded(f"request deadline passed before {endpoint} call")
+    return min(timeout, remaining)
+
+
+# ==================== CIRCUIT BREAKERS ====================
+# One breaker per upstream API host (third-party endpoints have none). After failure_threshold consecutive timeouts/connection errors/5xx
+# the breaker opens and calls fail fast with the endpoint's usual connection error; after
+# reset_timeout_seconds a single probe call is let through (half-open) to decide whether to close again.
+
+_breaker_settings = {
+    'failure_threshold': get_setting('circuit_breaker', 'failure_threshold', 5),
+    'reset_timeout_seconds': get_setting('circuit_breaker', 'reset_timeout_seconds', 30),
+}
+
+
+class CircuitOpenError(Exception):
+    # Raised (and handed to on_error) when a call is rejected by an open breaker
+    pass
+
+
+class CircuitBreaker:
+    # closed -> open after consecutive failures, open -> half_open after the reset timeout,
+    # half_open -> closed on a successful probe or back to open on a failed one
+    
+    def __init__(self, host, failure_threshold, reset_timeout):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = Lock()
+    
+    def allow(self):
+        # True if a call may go out now (takes the probe slot when half-open)
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                log_circuit_state(self.host, 'half_open')
+            
+            if self.state == 'half_open':
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self.failures = 0
+            if self.state != 'closed':
+                self.state = 'closed'
+                log_circuit_state(self.host, 'closed')
+    
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                log_circuit_state(self.host, 'open', failures=self.failures)
+    
+    def release(self):
+        # Call finished without telling us anything about the upstream (e.g. local file error)
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def snapshot(self):
+        with self._lock:
+            info = {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected
+            }
+            if self.state == 'open':
+                info['retry_in_seconds'] = round(max(self.reset_timeout - (time.monotonic() - self.opened_at), 0), 1)
+            return info
+
+
+_breakers = {}  # {host: CircuitBreaker}
+_breakers_lock = Lock()
+
+
+def get_circuit_breaker(url):
+    # Get (or create) the breaker for this URL's host
+    host = urlsplit(url).netloc
+    
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, _breaker_settings['failure_threshold'], _breaker_settings['reset_timeout_seconds'])
+            _breakers[host] = breaker
+        return breaker
+
+
+def get_circuit_breaker_states():
+    # Breaker state per upstream host (for the health endpoint)
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    return {host: breaker.snapshot() for host, breaker in breakers}
+
+
+def record_outcome(breaker, kind=None, status_code=None):
+    # Feed a call's outcome to its breaker (None for third-party endpoints)
+    # kind: classify_error() result when the request raised, status_code when a response came back
+    if breaker is None:
+        return
+    if status_code is not None:
+        if status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    elif kind in ('timeout', 'connection'):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+# ==================== REQUEST PLANS ====================
+
+def classify_error(error):
+    # Map an exception raised during a request to a transport-neutral kind
+    # Returns: 'timeout', 'connection', 'request' (other HTTP client error) or 'other'
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(error, requests.exceptions.RequestException):
+        return 'request'
+    return 'other'
+
+
+def execute_plan(plan):
+    # Run a request plan over the pooled sync sessions
+    # plan: dict with 'endpoint', 'method', 'url', optional 'kwargs' and 'upload',
+    #       'parse' (response -> result) and 'on_error' (kind, error -> result)
+    
+    if deadline_expired():
+        return plan['on_error']('timeout', DeadlineExceeded(f"request deadline passed before {plan['endpoint']} call"))
+    
+    # Arbitrary media hosts get no breaker - one flaky CDN mustn't leave a breaker (or a health entry) behind
+    breaker = None if plan['endpoint'] in THIRD_PARTY_ENDPOINTS else get_circuit_breaker(plan['url'])
+    if breaker is not None and not breaker.allow():
+        return plan['on_error']('connection', CircuitOpenError(f"{breaker.host} is unavailable (circuit open)"))
+    
+    start = time.monotonic()
+    try:
+        kwargs = dict(plan.get('kwargs', {}))
+        upload = plan.get('upload')
+        
+        if upload:
+            # upload: (field_name, filename, file) - file is a path or an open binary file, streamed in chunks
+            field_name, filename, file = upload
+            progress = UploadProgress(filename)
+            with MultipartFileEncoder(kwargs.pop('data', {}), field_name, filename, file, progress.update) as body:
+                kwargs['data'] = body
+                kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Type': body.content_type}
+                response = http_request(plan['endpoint'], plan['method'], plan['url'], **kwargs)
+            progress.finish()
+        else:
+            response = http_request(plan['endpoint'], plan['method'], plan['url'], **kwargs)
+    
+    except Exception as e:
+        kind = classify_error(e)
+        # A timeout cut short by our own deadline says nothing about the upstream
+        if deadline_expired():
+            record_outcome(breaker)
+        else:
+            record_outcome(breaker, kind=kind)
+            if kind == 'timeout':
+                record_latency(plan['endpoint'], time.monotonic() - start)
+        return plan['on_error'](kind, e)
+    
+    record_outcome(breaker, status_code=response.status_code)
+    record_latency(plan['endpoint'], time.monotonic() - start)
+    
+    try:
+        return plan['parse'](response)
+    except Exception as e:
+        return plan['on_error'](classify_error(e), e)
+
+
+# ==================== UPLOAD METRICS ====================
+
+_upload_stats = {
+    'uploads': 0,
+    'bytes': 0,
+    'seconds': 0.0,
+}
+_upload_stats_lock = Lock()
+
+
+class UploadProgress:
+    # Tracks one streaming upload - logs each 25% step and records throughput when done
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.started = time.monotonic()
+        self.bytes_sent = 0
+        self.total = 0
+        self._next_step = 25
+    
+    def update(self, bytes_sent, total):
+        # MultipartFileEncoder progress callback
+        self.bytes_sent = bytes_sent
+        self.total = total
+        percent = bytes_sent * 100 // total if total else 100
+        
+        while percent >= self._next_step and self._next_step < 100:
+            log_upload_progress(self.filename, self._next_step, bytes_sent, self._throughput())
+            self._next_step += 25
+    
+    def _throughput(self):
+        # Megabytes per second so far
+        elapsed = time.monotonic() - self.started
+        return self.bytes_sent / (1024 * 1024) / elapsed if elapsed > 0 else 0
+    
+    def finish(self):
+        # Record a completed upload (body fully handed to the socket and a response received)
+        elapsed = time.monotonic() - self.started
+        log_upload_done(self.filename, self.bytes_sent, elapsed * 1000, self._throughput())
+        
+        with _upload_stats_lock:
+            _upload_stats['uploads'] += 1
+            _upload_stats['bytes'] += self.bytes_sent
+            _upload_stats['seconds'] += elapsed
+
+
+def get_upload_stats():
+    # Streaming upload totals and average throughput (for the health endpoint)
+    with _upload_stats_lock:
+        seconds = _upload_stats['seconds']
+        return {
+            'uploads': _upload_stats['uploads'],
+            'megabytes': round(_upload_stats['bytes'] / (1024 * 1024), 1),
+            'avg_mb_per_second': round(_upload_stats['bytes'] / (1024 * 1024) / seconds, 2) if seconds else 0
+        }
+
+
 # ==================== GREEN API CREDENTIALS ====================
 
 # Thread-safe credential storage for Green API
@@ -55,78 +568,84 @@ def _get_greenapi_credentials():
 BATGPT_API_BASE = "https://batgpt.vercel.app/api/gpt"
 
 
-def chatgpt_send_message(message, gpt_chat_id=None):
-    # Send message to ChatGPT API and get response
-    # Args: message (str), gpt_chat_id (str, optional) - for conversation continuity
-    # Returns: dict with 'success', 'response', 'chat_id' or error details
+def _parse_chatgpt_response(response):
+    # Log raw response
+    log_raw_response('ChatGPT API', response.text, response.status_code)
     
-    log_chatgpt_request(gpt_chat_id)
+    if response.status_code != 200:
+        log_chatgpt_error('http', status_code=response.status_code)
+        return {
+            'success': False,
+            'error_type': 'http_error',
+            'status_code': response.status_code
+        }
     
-    try:
-        encoded_message = quote(message)
-        
-        if gpt_chat_id:
-            url = f"{BATGPT_API_BASE}?chatid={gpt_chat_id}&message={encoded_message}"
-        else:
-            url = f"{BATGPT_API_BASE}?message={encoded_message}"
-        
-        # Log raw request
-        log_raw_request('ChatGPT API', {'url': url, 'message': message[:100], 'chat_id': gpt_chat_id})
-        
-        response = requests.get(url, timeout=30)
-        
-        # Log raw response
-        log_raw_response('ChatGPT API', response.text if response else 'No response', response.status_code if response else None)
-        
-        if response.status_code != 200:
-            log_chatgpt_error('http', status_code=response.status_code)
-            return {
-                'success': False,
-                'error_type': 'http_error',
-                'status_code': response.status_code
-            }
-        
-        data = response.json()
-        
-        # Extract response and chat ID
-        gpt_response = data.get('reply') or data.get('response') or data.get('message')
-        new_chat_id = data.get('chatid') or data.get('chat_id')
-        
-        if not gpt_response:
-            log_chatgpt_error('no_response')
-            return {
-                'success': False,
-                'error_type': 'no_response',
-                'raw_data': data
-            }
-        
-        log_chatgpt_response(gpt_response)
+    data = response.json()
+    
+    # Extract response and chat ID
+    gpt_response = data.get('reply') or data.get('response') or data.get('message')
+    new_chat_id = data.get('chatid') or data.get('chat_id')
+    
+    if not gpt_response:
+        log_chatgpt_error('no_response')
         return {
-            'success': True,
-            'response': gpt_response,
-            'chat_id': new_chat_id
+            'success': False,
+            'error_type': 'no_response',
+            'raw_data': data
         }
-        
-    except requests.exceptions.Timeout:
+    
+    log_chatgpt_response(gpt_response)
+    return {
+        'success': True,
+        'response': gpt_response,
+        'chat_id': new_chat_id
+    }
+
+
+def _chatgpt_error(kind, error):
+    if kind == 'timeout':
         log_chatgpt_error('timeout')
         return {
             'success': False,
             'error_type': 'timeout'
         }
-    except requests.exceptions.RequestException as e:
-        log_chatgpt_error('connection', error=str(e))
+    if kind in ('connection', 'request'):
+        log_chatgpt_error('connection', error=str(error))
         return {
             'success': False,
             'error_type': 'connection_error',
-            'error': str(e)
-        }
-    except Exception as e:
-        log_chatgpt_error('processing', error=str(e))
-        return {
-            'success': False,
-            'error_type': 'processing_error',
-            'error': str(e)
+            'error': str(error)
         }
+    log_chatgpt_error('processing', error=str(error))
+    return {
+        'success': False,
+        'error_type': 'processing_error',
+        'error': str(error)
+    }
+
+
+def _chatgpt_plan(message, gpt_chat_id=None):
+    # Request plan for one ChatGPT call (sent by core/async_api_requests.py)
+    
+    log_chatgpt_request(gpt_chat_id)
+    
+    encoded_message = quote(message)
+    
+    if gpt_chat_id:
+        url = f"{BATGPT_API_BASE}?chatid={gpt_chat_id}&message={encoded_message}"
+    else:
+        url = f"{BATGPT_API_BASE}?message={encoded_message}"
+    
+    # Log raw request
+    log_raw_request('ChatGPT API', {'url': url, 'message': message[:100], 'chat_id': gpt_chat_id})
+    
+    return {
+        'endpoint': 'chatgpt',
+        'method': 'GET',
+        'url': url,
+        'parse': _parse_chatgpt_response,
+        'on_error': _chatgpt_error
+    }
 
 
 # ==================== VIDEO DOWNLOADER API ====================
@@ -134,367 +653,526 @@ def chatgpt_send_message(message, gpt_chat_id=None):
 BATGPT_DOWNLOADER_API = "https://batgpt.vercel.app/api/alldl"
 
 
-def video_download_request(url):
-    # Download video from social media URL using BatGPT API
-    # Args: url (str) - social media video URL
-    # Returns: dict with 'success', 'media_url', 'title' or error details
+def _parse_video_response(response):
+    # Log raw response
+    log_raw_response('Video Downloader API', response.text, response.status_code)
     
-    log_video_request(url)
+    if response.status_code != 200:
+        log_video_error('http', status_code=response.status_code, response_text=response.text[:200])
+        return {
+            'success': False,
+            'error_type': 'http_error',
+            'status_code': response.status_code,
+            'response_text': response.text[:200]
+        }
     
-    try:
-        encoded_url = quote(url, safe='')
-        api_url = f"{BATGPT_DOWNLOADER_API}?url={encoded_url}"
-        
-        # Log raw request
-        log_raw_request('Video Downloader API', {'api_url': api_url, 'url': url[:100]})
-        
-        response = requests.get(api_url, timeout=60)
-        
-        # Log raw response
-        log_raw_response('Video Downloader API', response.text if response else 'No response', response.status_code if response else None)
-        
-        if response.status_code != 200:
-            log_video_error('http', status_code=response.status_code, response_text=response.text[:200])
-            return {
-                'success': False,
-                'error_type': 'http_error',
-                'status_code': response.status_code,
-                'response_text': response.text[:200]
-            }
-        
-        data = response.json()
-        
-        # Check if download was successful
-        if not data.get('success') and data.get('success') is not None:
-            log_video_error('api_failed', raw_data=str(data)[:200])
-            return {
-                'success': False,
-                'error_type': 'api_failed',
-                'raw_data': data
-            }
-        
-        media_info = data.get('mediaInfo', {})
-        
-        # Extract video URL and title
-        if isinstance(media_info, dict):
-            video_url = media_info.get('videoUrl')
-            title = media_info.get('title', 'Downloaded Video')
-        else:
-            video_url = None
-            title = 'Downloaded Video'
-        
-        if not video_url:
-            log_video_error('no_url', media_info=str(media_info)[:200])
-            return {
-                'success': False,
-                'error_type': 'no_video_url',
-                'media_info': media_info
-            }
-        
-        log_video_response(title)
+    data = response.json()
+    
+    # Check if download was successful
+    if not data.get('success') and data.get('success') is not None:
+        log_video_error('api_failed', raw_data=str(data)[:200])
         return {
-            'success': True,
-            'media_url': video_url,
-            'title': title
+            'success': False,
+            'error_type': 'api_failed',
+            'raw_data': data
         }
-        
-    except requests.exceptions.Timeout:
+    
+    media_info = data.get('mediaInfo', {})
+    
+    # Extract video URL and title
+    if isinstance(media_info, dict):
+        video_url = media_info.get('videoUrl')
+        title = media_info.get('title', 'Downloaded Video')
+    else:
+        video_url = None
+        title = 'Downloaded Video'
+    
+    if not video_url:
+        log_video_error('no_url', media_info=str(media_info)[:200])
+        return {
+            'success': False,
+            'error_type': 'no_video_url',
+            'media_info': media_info
+        }
+    
+    log_video_response(title)
+    return {
+        'success': True,
+        'media_url': video_url,
+        'title': title
+    }
+
+
+def _video_error(kind, error):
+    if kind == 'timeout':
         log_video_error('timeout')
         return {
             'success': False,
             'error_type': 'timeout'
         }
-    except requests.exceptions.RequestException as e:
-        log_video_error('connection', error=str(e))
+    if kind in ('connection', 'request'):
+        log_video_error('connection', error=str(error))
         return {
             'success': False,
             'error_type': 'connection_error',
-            'error': str(e)
+            'error': str(error)
         }
-    except ValueError as e:
-        log_video_error('json', error=str(e))
+    if isinstance(error, ValueError):
+        log_video_error('json', error=str(error))
         return {
             'success': False,
             'error_type': 'json_parse_error',
-            'error': str(e)
+            'error': str(error)
         }
-    except Exception as e:
-        log_video_error('processing', error=str(e))
+    log_video_error('processing', error=str(error))
+    return {
+        'success': False,
+        'error_type': 'processing_error',
+        'error': str(error)
+    }
+
+
+def _video_plan(url):
+    # Request plan for one BatGPT downloader call (sent by core/async_api_requests.py)
+    
+    log_video_request(url)
+    
+    encoded_url = quote(url, safe='')
+    api_url = f"{BATGPT_DOWNLOADER_API}?url={encoded_url}"
+    
+    # Log raw request
+    log_raw_request('Video Downloader API', {'api_url': api_url, 'url': url[:100]})
+    
+    return {
+        'endpoint': 'video_download',
+        'method': 'GET',
+        'url': api_url,
+        'parse': _parse_video_response,
+        'on_error': _video_error
+    }
+
+
+def _parse_redirect_response(response):
+    if response.status_code in (301, 302, 303, 307, 308) and response.headers.get('Location'):
         return {
-            'success': False,
-            'error_type': 'processing_error',
-            'error': str(e)
+            'success': True,
+            'url': urljoin(response.url, response.headers['Location'])
         }
+    return {
+        'success': False,
+        'error_type': 'no_redirect',
+        'status_code': response.status_code
+    }
 
 
-# ==================== LINK SHORTENER API ====================
+def _probe_error(kind, error):
+    # Shared error handler for the lightweight probes (short links, media size)
+    return {
+        'success': False,
+        'error_type': kind,
+        'error': str(error)
+    }
 
-ICE_BIO_API_KEY = os.getenv("ICE_BIO_API_KEY", "")
-ICE_BIO_API_URL = "https://ice.bio/api/url/add"
-ICE_BIO_LIST_URL = "https://ice.bio/api/urls"
 
+def short_link_expand_request(url):
+    # Follow one redirect hop of a short link (vm.tiktok.com, fb.watch, ...) without fetching the page
+    # Args: url (str)
+    # Returns: dict with 'success', 'url' (redirect target) or error details
+    return execute_plan({
+        'endpoint': 'short_link_expand',
+        'method': 'HEAD',
+        'url': url,
+        'kwargs': {'allow_redirects': False},
+        'parse': _parse_redirect_response,
+        'on_error': _probe_error
+    })
 
-def link_shorten_request(url, custom_alias=None, password=None):
-    # Shorten URL using ice.bio API
-    # Args: url (str), custom_alias (str, optional), password (str, optional)
-    # Returns: dict with 'success', 'link_id', 'short_url' or error details
-    
-    log_link_shorten_request(url)
-    
+
+def _parse_media_probe(response):
+    # Size from Content-Range (206 to a ranged GET) or Content-Length; the body is never read
     try:
-        headers = {
-            'Authorization': f'Bearer {ICE_BIO_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'url': url,
-            'channel': 159,
-        }
-        
-        if custom_alias:
-            payload['custom'] = custom_alias
-        
-        if password:
-            payload['password'] = password
-        
-        # Log raw request
-        log_raw_request('Link Shortener API', {'url': ICE_BIO_API_URL, 'payload': payload})
-        
-        response = requests.post(ICE_BIO_API_URL, headers=headers, json=payload, timeout=30)
-        
-        # Log raw response
-        log_raw_response('Link Shortener API', response.text if response else 'No response', response.status_code if response else None)
-        
-        if response.status_code != 200:
-            log_link_error('http', status_code=response.status_code)
+        if response.status_code not in (200, 206):
             return {
                 'success': False,
                 'error_type': 'http_error',
                 'status_code': response.status_code
             }
         
-        data = response.json()
+        size = None
+        content_range = response.headers.get('Content-Range', '')
+        content_length = response.headers.get('Content-Length', '')
         
-        if data.get('error') == 0:
-            link_id = data.get('id')
-            short_url = data.get('shorturl')
-            
-            if not link_id or not short_url:
-                log_link_error('incomplete', raw_data=str(data)[:200])
-                return {
-                    'success': False,
-                    'error_type': 'incomplete_response',
-                    'raw_data': data
-                }
-            
-            log_link_shorten_response(short_url, link_id)
-            return {
-                'success': True,
-                'link_id': link_id,
-                'short_url': short_url
-            }
-        else:
-            log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'An error occurred'))
-            return {
-                'success': False,
-                'error_type': 'api_error',
-                'error_code': data.get('error', 'Unknown'),
-                'error_message': data.get('msg', 'An error occurred')
-            }
-            
-    except requests.exceptions.Timeout:
+        if response.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            size = int(total) if total.isdigit() else None
+        elif content_length.isdigit():
+            size = int(content_length)
+        
+        return {
+            'success': True,
+            'size': size,
+            'content_type': response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        }
+    finally:
+        response.close()
+
+
+def _media_probe_plan(media_url, ranged=False):
+    # Request plan for one media_probe_request step: HEAD, or a ranged GET for the first byte
+    if ranged:
+        kwargs = {'headers': {'Range': 'bytes=0-0'}, 'stream': True}
+    else:
+        kwargs = {'allow_redirects': True}
+    
+    return {
+        'endpoint': 'media_probe',
+        'method': 'GET' if ranged else 'HEAD',
+        'url': media_url,
+        'kwargs': kwargs,
+        'parse': _parse_media_probe,
+        'on_error': _probe_error
+    }
+
+
+def media_probe_request(media_url):
+    # Probe a media URL for size and type without downloading it
+    # HEAD first; a ranged GET for the first byte if HEAD is refused or has no size
+    # Returns: dict with 'success', 'size' (bytes or None), 'content_type', 'method' ('head'/'range') or error details
+    
+    result = execute_plan(_media_probe_plan(media_url))
+    if result.get('success') and result.get('size') is not None:
+        result['method'] = 'head'
+        return result
+    
+    ranged = execute_plan(_media_probe_plan(media_url, ranged=True))
+    if ranged.get('success'):
+        ranged['method'] = 'range'
+        return ranged
+    
+    # HEAD answered without a size - still tells us the file is reachable
+    if result.get('success'):
+        result['method'] = 'head'
+        return result
+    return ranged
+
+
+def _save_media_stream(response, suffix):
+    if response.status_code != 200:
+        response.close()
+        return None
+    
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix='relay_')
+    try:
+        with response, temp_file:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                temp_file.write(chunk)
+        return temp_file.name
+    except Exception:
+        os.remove(temp_file.name)
+        raise
+
+
+def media_relay_download(media_url, suffix='.mp4'):
+    # Stream a media file to a temp file in chunks, for relaying through sendFileByUpload
+    # Returns: temp file path or None on error (caller removes the file)
+    return execute_plan({
+        'endpoint': 'media_relay',
+        'method': 'GET',
+        'url': media_url,
+        'kwargs': {'stream': True},
+        'parse': lambda response: _save_media_stream(response, suffix),
+        'on_error': _greenapi_error
+    })
+
+
+# ==================== LINK SHORTENER API ====================
+
+ICE_BIO_API_KEY = os.getenv("ICE_BIO_API_KEY", "")
+ICE_BIO_API_URL = "https://ice.bio/api/url/add"
+ICE_BIO_LIST_URL = "https://ice.bio/api/urls"
+
+
+def _ice_bio_headers():
+    return {
+        'Authorization': f'Bearer {ICE_BIO_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+
+def _link_error(kind, error):
+    # Shared error handler for ice.bio calls
+    if kind == 'timeout':
         log_link_error('timeout')
         return {
             'success': False,
             'error_type': 'timeout'
         }
-    except requests.exceptions.ConnectionError as e:
-        log_link_error('connection', error=str(e))
+    if kind == 'connection':
+        log_link_error('connection', error=str(error))
         return {
             'success': False,
             'error_type': 'connection_error',
-            'error': str(e)
+            'error': str(error)
         }
-    except Exception as e:
-        log_link_error('unexpected', error=str(e))
+    log_link_error('unexpected', error=str(error))
+    return {
+        'success': False,
+        'error_type': 'unexpected_error',
+        'error': str(error)
+    }
+
+
+def _parse_link_shorten_response(response):
+    # Log raw response
+    log_raw_response('Link Shortener API', response.text, response.status_code)
+    
+    if response.status_code != 200:
+        log_link_error('http', status_code=response.status_code)
         return {
             'success': False,
-            'error_type': 'unexpected_error',
-            'error': str(e)
+            'error_type': 'http_error',
+            'status_code': response.status_code
         }
-
-
-def link_list_request(limit=1000, page=1):
-    # Fetch all shortened links from ice.bio API
-    # Args: limit (int), page (int)
-    # Returns: dict with 'success', 'links' list or error details
     
-    log_link_list_request()
+    data = response.json()
     
-    try:
-        headers = {
-            'Authorization': f'Bearer {ICE_BIO_API_KEY}',
-            'Content-Type': 'application/json'
-        }
+    if data.get('error') == 0:
+        link_id = data.get('id')
+        short_url = data.get('shorturl')
         
-        params = {
-            'limit': limit,
-            'page': page,
-            'order': 'date'
-        }
-        
-        response = requests.get(ICE_BIO_LIST_URL, headers=headers, params=params, timeout=30)
-        
-        if response.status_code != 200:
-            log_link_error('http', status_code=response.status_code)
+        if not link_id or not short_url:
+            log_link_error('incomplete', raw_data=str(data)[:200])
             return {
                 'success': False,
-                'error_type': 'http_error',
-                'status_code': response.status_code
+                'error_type': 'incomplete_response',
+                'raw_data': data
             }
         
-        data = response.json()
-        
-        if data.get('error') == '0' or data.get('error') == 0:
-            urls = data.get('data', {}).get('urls', [])
-            log_link_list_response(len(urls))
-            return {
-                'success': True,
-                'links': urls
-            }
-        else:
-            log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'Unknown error'))
-            return {
-                'success': False,
-                'error_type': 'api_error',
-                'error_message': data.get('msg', 'Unknown error')
-            }
-            
-    except Exception as e:
-        log_link_error('unexpected', error=str(e))
+        log_link_shorten_response(short_url, link_id)
+        return {
+            'success': True,
+            'link_id': link_id,
+            'short_url': short_url
+        }
+    else:
+        log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'An error occurred'))
         return {
             'success': False,
-            'error_type': 'unexpected_error',
-            'error': str(e)
+            'error_type': 'api_error',
+            'error_code': data.get('error', 'Unknown'),
+            'error_message': data.get('msg', 'An error occurred')
         }
 
 
-def link_stats_request(link_id):
-    # Fetch statistics for a specific shortened link from ice.bio API
-    # Args: link_id (int or str) - the ID of the shortened link
-    # Returns: dict with 'success', 'details', 'data' or error details
+def link_shorten_request(url, custom_alias=None, password=None):
+    # Shorten URL using ice.bio API
+    # Args: url (str), custom_alias (str, optional), password (str, optional)
+    # Returns: dict with 'success', 'link_id', 'short_url' or error details
+    
+    log_link_shorten_request(url)
+    
+    payload = {
+        'url': url,
+        'channel': 159,
+    }
+    
+    if custom_alias:
+        payload['custom'] = custom_alias
+    
+    if password:
+        payload['password'] = password
+    
+    # Log raw request
+    log_raw_request('Link Shortener API', {'url': ICE_BIO_API_URL, 'payload': payload})
+    
+    return execute_plan({
+        'endpoint': 'link_shorten',
+        'method': 'POST',
+        'url': ICE_BIO_API_URL,
+        'kwargs': {'headers': _ice_bio_headers(), 'json': payload},
+        'parse': _parse_link_shorten_response,
+        'on_error': _link_error
+    })
+
+
+def _parse_link_list_response(response):
+    if response.status_code != 200:
+        log_link_error('http', status_code=response.status_code)
+        return {
+            'success': False,
+            'error_type': 'http_error',
+            'status_code': response.status_code
+        }
+    
+    data = response.json()
+    
+    if data.get('error') == '0' or data.get('error') == 0:
+        urls = data.get('data', {}).get('urls', [])
+        log_link_list_response(len(urls))
+        return {
+            'success': True,
+            'links': urls
+        }
+    else:
+        log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'Unknown error'))
+        return {
+            'success': False,
+            'error_type': 'api_error',
+            'error_message': data.get('msg', 'Unknown error')
+        }
+
+
+def _link_list_error(kind, error):
+    # The list call has always reported every failure as unexpected
+    return _link_error('other', error)
+
+
+def link_list_request(limit=1000, page=1):
+    # Fetch all shortened links from ice.bio API
+    # Args: limit (int), page (int)
+    # Returns: dict with 'success', 'links' list or error details
+    
+    log_link_list_request()
+    
+    params = {
+        'limit': limit,
+        'page': page,
+        'order': 'date'
+    }
+    
+    return execute_plan({
+        'endpoint': 'link_list',
+        'method': 'GET',
+        'url': ICE_BIO_LIST_URL,
+        'kwargs': {'headers': _ice_bio_headers(), 'params': params},
+        'parse': _parse_link_list_response,
+        'on_error': _link_list_error
+    })
+
+
+def _parse_link_stats_response(response, link_id):
+    if response.status_code != 200:
+        log_link_error('http', status_code=response.status_code)
+        return {
+            'success': False,
+            'error_type': 'http_error',
+            'status_code': response.status_code
+        }
     
-    log_link_stats_request(link_id)
+    data = response.json()
     
-    try:
-        headers = {
-            'Authorization': f'Bearer {ICE_BIO_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        url = f"https://ice.bio/api/url/{link_id}"
+    if data.get('error') == 0 or data.get('error') == '0':
+        details = data.get('details', {})
+        stats_data = data.get('data', {})
         
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            log_link_error('http', status_code=response.status_code)
+        if not details or not stats_data:
+            log_link_error('incomplete', raw_data=str(data)[:200])
             return {
                 'success': False,
-                'error_type': 'http_error',
-                'status_code': response.status_code
+                'error_type': 'incomplete_response',
+                'raw_data': data
             }
         
-        data = response.json()
-        
-        if data.get('error') == 0 or data.get('error') == '0':
-            details = data.get('details', {})
-            stats_data = data.get('data', {})
-            
-            if not details or not stats_data:
-                log_link_error('incomplete', raw_data=str(data)[:200])
-                return {
-                    'success': False,
-                    'error_type': 'incomplete_response',
-                    'raw_data': data
-                }
-            
-            clicks = stats_data.get('clicks', 0)
-            log_link_stats_response(link_id, clicks)
-            return {
-                'success': True,
-                'details': details,
-                'data': stats_data
-            }
-        else:
-            log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'Link not found or error'))
-            return {
-                'success': False,
-                'error_type': 'api_error',
-                'error_message': data.get('msg', 'Link not found or error')
-            }
-            
-    except requests.exceptions.Timeout:
-        log_link_error('timeout')
-        return {
-            'success': False,
-            'error_type': 'timeout'
-        }
-    except requests.exceptions.ConnectionError as e:
-        log_link_error('connection', error=str(e))
+        clicks = stats_data.get('clicks', 0)
+        log_link_stats_response(link_id, clicks)
         return {
-            'success': False,
-            'error_type': 'connection_error',
-            'error': str(e)
+            'success': True,
+            'details': details,
+            'data': stats_data
         }
-    except Exception as e:
-        log_link_error('unexpected', error=str(e))
+    else:
+        log_link_error('api', error_code=data.get('error', 'Unknown'), error_message=data.get('msg', 'Link not found or error'))
         return {
             'success': False,
-            'error_type': 'unexpected_error',
-            'error': str(e)
+            'error_type': 'api_error',
+            'error_message': data.get('msg', 'Link not found or error')
         }
 
 
+def link_stats_request(link_id):
+    # Fetch statistics for a specific shortened link from ice.bio API
+    # Args: link_id (int or str) - the ID of the shortened link
+    # Returns: dict with 'success', 'details', 'data' or error details
+    
+    log_link_stats_request(link_id)
+    
+    return execute_plan({
+        'endpoint': 'link_stats',
+        'method': 'GET',
+        'url': f"https://ice.bio/api/url/{link_id}",
+        'kwargs': {'headers': _ice_bio_headers()},
+        'parse': lambda response: _parse_link_stats_response(response, link_id),
+        'on_error': _link_error
+    })
+
+
 # ==================== GREEN API (WHATSAPP) ====================
 
+# Avatars stay in memory up to this size on their way from the CDN to sendFileByUpload
+AVATAR_SPOOL_MAX_BYTES = get_setting('avatars', 'spool_max_bytes', 1024 * 1024)
+
+def _greenapi_url(method):
+    # Build Green API method URL for the current instance
+    instance_id, token = _get_greenapi_credentials()
+    api_subdomain = instance_id[:4]
+    return f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/{method}/{token}"
+
+
+def _parse_greenapi_json(response):
+    # Plain Green API calls: JSON body on 200, None otherwise
+    return response.json() if response.status_code == 200 else None
+
+
+def _greenapi_error(kind, error):
+    return None
+
+
+def _parse_greenapi_send(response, raw_name=None):
+    # Green API send calls: JSON body on 200, None otherwise, with send result logging
+    result = response.json() if response.status_code == 200 else None
+    
+    # Log raw response
+    if raw_name:
+        log_raw_response(raw_name, result if result else response.text, response.status_code)
+    
+    if result:
+        log_greenapi_response(True, result.get('idMessage', 'N/A'))
+    else:
+        log_greenapi_response(False)
+    
+    return result
+
+
+def _greenapi_send_error(kind, error):
+    log_greenapi_response(False)
+    return None
+
+
 def greenapi_send_message(chat_id, text):
     # Send text message via Green API
     # Args: chat_id, text
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
-    
     log_greenapi_send('message', chat_id)
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendMessage/{token}"
-        
-        payload = {
-            "chatId": chat_id,
-            "message": text
-        }
-        
-        # Log raw request
-        log_raw_request('Green API - sendMessage', {'url': url, 'payload': payload})
-        
-        response = requests.post(url, json=payload, timeout=30)
-        result = response.json() if response.status_code == 200 else None
-        
-        # Log raw response
-        log_raw_response('Green API - sendMessage', result if result else response.text, response.status_code)
-        
-        if result:
-            log_greenapi_response(True, result.get('idMessage', 'N/A'))
-        else:
-            log_greenapi_response(False)
-        
-        return result
-        
-    except Exception:
-        log_greenapi_response(False)
-        return None
+    url = _greenapi_url('sendMessage')
+    
+    payload = {
+        "chatId": chat_id,
+        "message": text
+    }
+    
+    # Log raw request
+    log_raw_request('Green API - sendMessage', {'url': url, 'payload': payload})
+    
+    return execute_plan({
+        'endpoint': 'greenapi_send_message',
+        'method': 'POST',
+        'url': url,
+        'kwargs': {'json': payload},
+        'parse': lambda response: _parse_greenapi_send(response, 'Green API - sendMessage'),
+        'on_error': _greenapi_send_error
+    })
 
 
 def greenapi_send_file_by_url(chat_id, file_url, filename, caption=None):
@@ -502,70 +1180,82 @@ def greenapi_send_file_by_url(chat_id, file_url, filename, caption=None):
     # Args: chat_id, file_url, filename, caption (optional)
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
-    
     log_greenapi_send('file_url', chat_id, filename=filename)
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendFileByUrl/{token}"
-        
-        payload = {
-            "chatId": chat_id,
-            "urlFile": file_url,
-            "fileName": filename
-        }
-        
-        if caption:
-            payload["caption"] = caption
-        
-        response = requests.post(url, json=payload, timeout=60)
-        result = response.json() if response.status_code == 200 else None
-        
-        if result:
-            log_greenapi_response(True, result.get('idMessage', 'N/A'))
-        else:
-            log_greenapi_response(False)
-        
-        return result
-        
-    except Exception:
-        log_greenapi_response(False)
-        return None
+    payload = {
+        "chatId": chat_id,
+        "urlFile": file_url,
+        "fileName": filename
+    }
+    
+    if caption:
+        payload["caption"] = caption
+    
+    return execute_plan({
+        'endpoint': 'greenapi_send_file_url',
+        'method': 'POST',
+        'url': _greenapi_url('sendFileByUrl'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_send,
+        'on_error': _greenapi_send_error
+    })
 
 
-def greenapi_send_file_by_upload(chat_id, file_path, filename, caption=None):
+def greenapi_send_file_by_upload(chat_id, file, filename, caption=None):
     # Upload and send file via Green API
-    # Args: chat_id, file_path, filename, caption (optional)
+    # Args: chat_id, file (path or open binary file), filename, caption (optional)
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
-    
     log_greenapi_send('file_upload', chat_id, filename=filename)
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendFileByUpload/{token}"
-        
-        with open(file_path, 'rb') as f:
-            files = {'file': (filename, f)}
-            data = {'chatId': chat_id}
-            if caption:
-                data['caption'] = caption
-            
-            response = requests.post(url, files=files, data=data, timeout=60)
-            result = response.json() if response.status_code == 200 else None
-            
-            if result:
-                log_greenapi_response(True, result.get('idMessage', 'N/A'))
-            else:
-                log_greenapi_response(False)
-            
-            return result
-        
-    except Exception:
-        log_greenapi_response(False)
-        return None
+    data = {'chatId': chat_id}
+    if caption:
+        data['caption'] = caption
+    
+    return execute_plan({
+        'endpoint': 'greenapi_send_file_upload',
+        'method': 'POST',
+        'url': _greenapi_url('sendFileByUpload'),
+        'kwargs': {'data': data},
+        'upload': ('file', filename, file),
+        'parse': _parse_greenapi_send,
+        'on_error': _greenapi_send_error
+    })
+
+
+def _parse_greenapi_forward(response):
+    # forwardMessages answers {"messages": [ids of the new messages]}
+    result = response.json() if response.status_code == 200 else None
+    
+    if result and result.get('messages'):
+        log_greenapi_response(True, result['messages'][0])
+        return result
+    
+    log_greenapi_response(False)
+    return None
+
+
+def greenapi_forward_messages(chat_id, chat_id_from, message_ids):
+    # Forward existing messages (e.g. an already delivered video) via Green API
+    # Args: chat_id (target), chat_id_from (chat holding the messages), message_ids (list of idMessage)
+    # Returns: API response JSON with 'messages' or None on error
+    
+    log_greenapi_send('forward', chat_id, chat_id_from=chat_id_from)
+    
+    payload = {
+        "chatId": chat_id,
+        "chatIdFrom": chat_id_from,
+        "messages": list(message_ids)
+    }
+    
+    return execute_plan({
+        'endpoint': 'greenapi_forward_messages',
+        'method': 'POST',
+        'url': _greenapi_url('forwardMessages'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_forward,
+        'on_error': _greenapi_send_error
+    })
 
 
 def greenapi_send_poll(chat_id, message, options):
@@ -573,23 +1263,20 @@ def greenapi_send_poll(chat_id, message, options):
     # Args: chat_id, message, options (list of dicts)
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
+    payload = {
+        "chatId": chat_id,
+        "message": message,
+        "options": options
+    }
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendPoll/{token}"
-        
-        payload = {
-            "chatId": chat_id,
-            "message": message,
-            "options": options
-        }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    return execute_plan({
+        'endpoint': 'greenapi_send_poll',
+        'method': 'POST',
+        'url': _greenapi_url('sendPoll'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_send_location(chat_id, latitude, longitude, name=None, address=None):
@@ -597,28 +1284,25 @@ def greenapi_send_location(chat_id, latitude, longitude, name=None, address=None
     # Args: chat_id, latitude, longitude, name (optional), address (optional)
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
+    payload = {
+        "chatId": chat_id,
+        "latitude": latitude,
+        "longitude": longitude
+    }
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendLocation/{token}"
-        
-        payload = {
-            "chatId": chat_id,
-            "latitude": latitude,
-            "longitude": longitude
-        }
-        
-        if name:
-            payload["nameLocation"] = name
-        if address:
-            payload["address"] = address
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    if name:
+        payload["nameLocation"] = name
+    if address:
+        payload["address"] = address
+    
+    return execute_plan({
+        'endpoint': 'greenapi_send_location',
+        'method': 'POST',
+        'url': _greenapi_url('sendLocation'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_send_contact(chat_id, phone, first_name, last_name=None, company=None):
@@ -626,161 +1310,403 @@ def greenapi_send_contact(chat_id, phone, first_name, last_name=None, company=No
     # Args: chat_id, phone, first_name, last_name (optional), company (optional)
     # Returns: API response JSON or None on error
     
-    instance_id, token = _get_greenapi_credentials()
+    contact = {
+        "phoneContact": phone,
+        "firstName": first_name
+    }
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/sendContact/{token}"
-        
-        contact = {
-            "phoneContact": phone,
-            "firstName": first_name
-        }
-        
-        if last_name:
-            contact["lastName"] = last_name
-        if company:
-            contact["company"] = company
-        
-        payload = {
-            "chatId": chat_id,
-            "contact": contact
-        }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    if last_name:
+        contact["lastName"] = last_name
+    if company:
+        contact["company"] = company
+    
+    payload = {
+        "chatId": chat_id,
+        "contact": contact
+    }
+    
+    return execute_plan({
+        'endpoint': 'greenapi_send_contact',
+        'method': 'POST',
+        'url': _greenapi_url('sendContact'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_get_settings():
     # Get instance settings via Green API
     # Returns: API response JSON or None on error
-    
-    instance_id, token = _get_greenapi_credentials()
-    
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/getSettings/{token}"
-        
-        response = requests.get(url, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    return execute_plan({
+        'endpoint': 'greenapi_get_settings',
+        'method': 'GET',
+        'url': _greenapi_url('getSettings'),
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_check_whatsapp(phone_number):
     # Check if number has WhatsApp via Green API
     # Args: phone_number
     # Returns: API response JSON or None on error
-    
-    instance_id, token = _get_greenapi_credentials()
-    
     try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/checkWhatsapp/{token}"
-        
         payload = {
             "phoneNumber": int(phone_number) if isinstance(phone_number, str) else phone_number
         }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
+    except ValueError:
         return None
+    
+    return execute_plan({
+        'endpoint': 'greenapi_check_whatsapp',
+        'method': 'POST',
+        'url': _greenapi_url('checkWhatsapp'),
+        'kwargs': {'json': payload},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_get_avatar(chat_id):
     # Get avatar via Green API
     # Args: chat_id
     # Returns: API response JSON or None on error
-    
-    instance_id, token = _get_greenapi_credentials()
-    
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/getAvatar/{token}"
-        
-        payload = {
-            "chatId": chat_id
-        }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    return execute_plan({
+        'endpoint': 'greenapi_get_avatar',
+        'method': 'POST',
+        'url': _greenapi_url('getAvatar'),
+        'kwargs': {'json': {"chatId": chat_id}},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_get_contact_info(chat_id):
     # Get contact info via Green API
     # Args: chat_id
     # Returns: API response JSON or None on error
-    
-    instance_id, token = _get_greenapi_credentials()
-    
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/getContactInfo/{token}"
-        
-        payload = {
-            "chatId": chat_id
-        }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
-        
-    except Exception:
-        return None
+    return execute_plan({
+        'endpoint': 'greenapi_get_contact_info',
+        'method': 'POST',
+        'url': _greenapi_url('getContactInfo'),
+        'kwargs': {'json': {"chatId": chat_id}},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
 
 
 def greenapi_get_group_data(group_id):
     # Get group data via Green API
     # Args: group_id (str) - group ID like "120363345164020774@g.us"
     # Returns: API response JSON with group info or None on error
+    return execute_plan({
+        'endpoint': 'greenapi_get_group_data',
+        'method': 'POST',
+        'url': _greenapi_url('getGroupData'),
+        'kwargs': {'json': {"groupId": group_id}},
+        'parse': _parse_greenapi_json,
+        'on_error': _greenapi_error
+    })
+
+
+def spool_chunks(chunks):
+    # Copy body chunks into a spooled buffer - kept in memory up to AVATAR_SPOOL_MAX_BYTES, spilled to disk past it
+    # Returns: the buffer rewound to the start (caller closes it)
+    spool = tempfile.SpooledTemporaryFile(max_size=AVATAR_SPOOL_MAX_BYTES)
+    try:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+
+def _parse_avatar_stream(response):
+    with response:
+        if response.status_code != 200:
+            return None
+        return spool_chunks(response.iter_content(chunk_size=64 * 1024))
+
+
+def greenapi_download_avatar(avatar_url):
+    # Download an avatar into a spooled buffer, ready to pass to greenapi_send_file_by_upload
+    # Args: avatar_url
+    # Returns: open binary file object or None on error (caller closes it)
+    return execute_plan({
+        'endpoint': 'avatar_download',
+        'method': 'GET',
+        'url': avatar_url,
+        'kwargs': {'stream': True},
+        'parse': _parse_avatar_stream,
+        'on_error': _greenapi_error
+    })
+
+
+# ==================== OUTBOUND SEND QUEUE ====================
+# Handlers enqueue sends and move on; a small worker pool delivers them.
+# Each chat is a lane: at most one of its items is in flight, so order is kept within a chat
+# while different chats go out in parallel. File sends can't take the last worker, so a slow
+# upload never holds up texts to other chats.
+# Adjacent text messages to the same chat within the coalesce window go out as one message,
+# and a token bucket per Green API instance (shared by all workers) keeps bursts under the upstream throttle.
+
+_send_queue_settings = {
+    'enabled': get_setting('send_queue', 'enabled', True),
+    'coalesce_window_ms': get_setting('send_queue', 'coalesce_window_ms', 300),
+    'max_merged_chars': get_setting('send_queue', 'max_merged_chars', 4000),
+    'rate_per_second': get_setting('send_queue', 'rate_per_second', 3),
+    'burst': get_setting('send_queue', 'burst', 5),
+    'workers': max(1, get_setting('send_queue', 'workers', 4)),
+}
+
+_FILE_OPERATIONS = ('file_url', 'file_upload')
+
+
+class TokenBucket:
+    # Token-bucket rate limiter - refills rate tokens per second, holds at most capacity
     
-    instance_id, token = _get_greenapi_credentials()
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
     
-    try:
-        api_subdomain = instance_id[:4]
-        url = f"https://{api_subdomain}.api.green-api.com/waInstance{instance_id}/getGroupData/{token}"
-        
-        payload = {
-            "groupId": group_id
+    def acquire(self):
+        # Block until a token is available, then take it
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                wait = (1 - self._tokens) / self.rate
+            
+            time.sleep(wait)
+
+
+_send_buckets = {}  # {instance_id: TokenBucket}
+_send_queue = deque()  # pending send items, oldest first
+_send_last_item = {}  # {chat_id: newest pending item for that chat}
+_send_condition = Condition()
+_send_workers = []
+_send_busy_chats = set()  # chats with an item in flight
+_send_busy_files = 0  # file sends in flight
+_send_stats = {
+    'sent': 0,
+    'failed': 0,
+    'coalesced': 0,
+    'wait_ms_total': 0.0,
+    'send_ms_total': 0.0,
+    'send_ms_max': 0.0,
+}
+
+
+def _get_send_bucket():
+    # Token bucket for the current Green API instance
+    instance_id, _ = _get_greenapi_credentials()
+    
+    with _send_condition:
+        bucket = _send_buckets.get(instance_id)
+        if bucket is None:
+            bucket = TokenBucket(_send_queue_settings['rate_per_second'], _send_queue_settings['burst'])
+            _send_buckets[instance_id] = bucket
+        return bucket
+
+
+def _enqueue_send(operation, chat_id, args, text=None):
+    # Queue a send item and return the Future that receives its API result
+    
+    now = time.monotonic()
+    
+    with _send_condition:
+        # Merge into the chat's newest pending text if it's still inside the window
+        last = _send_last_item.get(chat_id)
+        if (text is not None and last is not None and last['operation'] == 'message'
+                and now - last['enqueued_at'] <= _send_queue_settings['coalesce_window_ms'] / 1000
+                and sum(len(t) for t in last['texts']) + len(text) <= _send_queue_settings['max_merged_chars']):
+            last['texts'].append(text)
+            _send_stats['coalesced'] += 1
+            return last['future']
+        
+        item = {
+            'operation': operation,
+            'chat_id': chat_id,
+            'args': args,
+            'texts': [text] if text is not None else None,
+            'enqueued_at': now,
+            # Texts wait out the window so follow-ups can merge; files go as soon as it's their turn
+            'ready_at': now + (_send_queue_settings['coalesce_window_ms'] / 1000 if text is not None else 0),
+            'future': Future()
         }
+        _send_queue.append(item)
+        _send_last_item[chat_id] = item
         
-        response = requests.post(url, json=payload, timeout=30)
-        return response.json() if response.status_code == 200 else None
+        _send_workers[:] = [worker for worker in _send_workers if worker.is_alive()]
+        while len(_send_workers) < _send_queue_settings['workers']:
+            worker = Thread(target=_send_loop, name=f'greenapi-send-queue-{len(_send_workers)}', daemon=True)
+            worker.start()
+            _send_workers.append(worker)
         
-    except Exception:
-        return None
+        _send_condition.notify()
+        return item['future']
+
+
+def _next_send_item():
+    # Pop the oldest ready item whose chat has nothing older queued or in flight
+    # Called with _send_condition held; marks the item's chat (and file slot) busy
+    # Returns: item, or (None, seconds until the next item becomes ready)
+    global _send_busy_files
+    
+    now = time.monotonic()
+    blocked_chats = set(_send_busy_chats)
+    files_full = _send_busy_files >= max(1, _send_queue_settings['workers'] - 1)
+    next_ready = None
+    
+    for item in _send_queue:
+        if item['chat_id'] in blocked_chats:
+            continue
+        blocked_chats.add(item['chat_id'])
+        
+        if files_full and item['operation'] in _FILE_OPERATIONS:
+            continue
+        
+        if item['ready_at'] <= now:
+            _send_queue.remove(item)
+            if _send_last_item.get(item['chat_id']) is item:
+                del _send_last_item[item['chat_id']]
+            _send_busy_chats.add(item['chat_id'])
+            if item['operation'] in _FILE_OPERATIONS:
+                _send_busy_files += 1
+            return item, None
+        
+        wait = item['ready_at'] - now
+        next_ready = wait if next_ready is None else min(next_ready, wait)
+    
+    return None, next_ready
+
+
+def _send_loop():
+    # Worker: deliver queued items one at a time under the instance rate limit
+    global _send_busy_files
+    
+    while True:
+        with _send_condition:
+            item, wait = _next_send_item()
+            while item is None:
+                _send_condition.wait(wait)
+                item, wait = _next_send_item()
+        
+        try:
+            _deliver_send_item(item)
+        finally:
+            # Free the chat's lane (and file slot) and wake workers waiting on it
+            with _send_condition:
+                _send_busy_chats.discard(item['chat_id'])
+                if item['operation'] in _FILE_OPERATIONS:
+                    _send_busy_files -= 1
+                _send_condition.notify_all()
 
 
-def greenapi_download_avatar_file(avatar_url, chat_id):
-    # Download avatar from URL and save as temp file
-    # Args: avatar_url, chat_id
-    # Returns: temp file path or None on error
+def _deliver_send_item(item):
+    # Send one queued item, record its latency and resolve its Future
+    _get_send_bucket().acquire()
     
+    start = time.monotonic()
     try:
-        response = requests.get(avatar_url, timeout=30)
-        
-        if response.status_code != 200:
-            return None
-        
-        # Create temp file with unique name
-        clean_chat_id = chat_id.replace('@c.us', '').replace('@g.us', '')
-        temp_file = tempfile.NamedTemporaryFile(
-            delete=False,
-            suffix='.jpg',
-            prefix=f'avatar_{clean_chat_id}_'
-        )
-        temp_file.write(response.content)
-        temp_file.close()
-        
-        return temp_file.name
-        
+        # No request deadline here - the webhook's budget may be long gone after a wait in the queue or
+        # the token bucket, and a reply still has to go out; each send is bounded by its endpoint timeout
+        with request_deadline(None):
+            if item['operation'] == 'message':
+                result = greenapi_send_message(item['chat_id'], '\n\n'.join(item['texts']))
+            elif item['operation'] == 'file_url':
+                result = greenapi_send_file_by_url(item['chat_id'], *item['args'])
+            elif item['operation'] == 'forward':
+                result = greenapi_forward_messages(item['chat_id'], *item['args'])
+            else:
+                result = greenapi_send_file_by_upload(item['chat_id'], *item['args'])
     except Exception:
-        return None
+        result = None
+    end = time.monotonic()
+    
+    wait_ms = (start - item['enqueued_at']) * 1000
+    send_ms = (end - start) * 1000
+    merged = len(item['texts']) if item['texts'] else 1
+    
+    with _send_condition:
+        _send_stats['sent' if result else 'failed'] += 1
+        _send_stats['wait_ms_total'] += wait_ms
+        _send_stats['send_ms_total'] += send_ms
+        _send_stats['send_ms_max'] = max(_send_stats['send_ms_max'], send_ms)
+    
+    log_greenapi_send_latency(item['operation'], item['chat_id'], wait_ms, send_ms, merged)
+    item['future'].set_result(result)
+
+
+def _send_now(operation, chat_id, args, text=None):
+    # Queue disabled - send inline and hand back an already-resolved Future
+    future = Future()
+    if operation == 'message':
+        future.set_result(greenapi_send_message(chat_id, text))
+    elif operation == 'file_url':
+        future.set_result(greenapi_send_file_by_url(chat_id, *args))
+    elif operation == 'forward':
+        future.set_result(greenapi_forward_messages(chat_id, *args))
+    else:
+        future.set_result(greenapi_send_file_by_upload(chat_id, *args))
+    return future
+
+
+def enqueue_send_message(chat_id, text):
+    # Queue a text message (merged with adjacent texts to the same chat)
+    # Returns: Future resolving to the API response JSON or None
+    if not _send_queue_settings['enabled']:
+        return _send_now('message', chat_id, (), text)
+    return _enqueue_send('message', chat_id, (), text)
+
+
+def enqueue_send_file_by_url(chat_id, file_url, filename, caption=None):
+    # Queue a file-by-URL send, delivered after anything already queued for the chat
+    # Returns: Future resolving to the API response JSON or None
+    if not _send_queue_settings['enabled']:
+        return _send_now('file_url', chat_id, (file_url, filename, caption))
+    return _enqueue_send('file_url', chat_id, (file_url, filename, caption))
+
+
+def enqueue_send_file_by_upload(chat_id, file, filename, caption=None):
+    # Queue a file upload - file is a path or an open binary file; keep it on disk / open until the Future resolves
+    # Returns: Future resolving to the API response JSON or None
+    if not _send_queue_settings['enabled']:
+        return _send_now('file_upload', chat_id, (file, filename, caption))
+    return _enqueue_send('file_upload', chat_id, (file, filename, caption))
+
+
+def enqueue_forward_message(chat_id, chat_id_from, id_message):
+    # Queue forwarding of an existing message, delivered after anything already queued for the chat
+    # Returns: Future resolving to the API response JSON or None
+    if not _send_queue_settings['enabled']:
+        return _send_now('forward', chat_id, (chat_id_from, [id_message]))
+    return _enqueue_send('forward', chat_id, (chat_id_from, [id_message]))
+
+
+def get_send_queue_stats():
+    # Outbound queue counters and per-send latency averages (for the health endpoint)
+    with _send_condition:
+        delivered = _send_stats['sent'] + _send_stats['failed']
+        return {
+            'pending': len(_send_queue),
+            'in_flight': len(_send_busy_chats),
+            'sent': _send_stats['sent'],
+            'failed': _send_stats['failed'],
+            'coalesced': _send_stats['coalesced'],
+            'avg_wait_ms': round(_send_stats['wait_ms_total'] / delivered, 1) if delivered else 0,
+            'avg_send_ms': round(_send_stats['send_ms_total'] / delivered, 1) if delivered else 0,
+            'max_send_ms': round(_send_stats['send_ms_max'], 1)
+        }
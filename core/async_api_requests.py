@@ -0,0 +1,278 @@
+# Async External API Requests
+# Runs the slow upstream calls - ChatGPT and BatGPT video resolution - as tasks on one shared event loop
+# over pooled httpx clients, so a worker can have many of them in flight without a thread per request
+# Same request plans (URLs, parsing, logging, breakers, deadlines) as core/api_requests.py - only the transport differs
+#
+# Usage from async code:  result = await async_video_download_request(url)
+# Usage from sync code:   result = video_download_request(url)  (runs the coroutine on the shared loop)
+
+import asyncio
+import random
+import time
+import weakref
+import httpx
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+
+from config.config import get_setting
+from core.api_requests import (
+    BATGPT_DOWNLOADER_API, CircuitOpenError, DeadlineExceeded,
+    get_circuit_breaker, record_outcome, record_latency, latency_percentile,
+    call_timeout, deadline_expired, time_remaining, get_request_deadline, request_deadline,
+    _chatgpt_plan, _video_plan
+)
+from core.logger import log_video_hedge, log_video_retry
+
+# ==================== EVENT LOOP ====================
+
+# Shared background loop for sync callers (Flask request threads, thread pools)
+_loop = None
+_loop_lock = Lock()
+
+
+def _get_loop():
+    # Get (or start) the background event loop thread
+    global _loop
+    
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            Thread(target=_loop.run_forever, name='async-http-loop', daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    # Run a coroutine on the shared loop and wait for its result (for sync callers)
+    # The caller's request deadline is carried over to the loop
+    # Must not be called from code already running on the shared loop
+    deadline = get_request_deadline()
+    
+    async def run():
+        with request_deadline(deadline):
+            return await coro
+    
+    return asyncio.run_coroutine_threadsafe(run(), _get_loop()).result(timeout)
+
+
+# ==================== HTTP CLIENTS ====================
+
+# One keep-alive client per upstream host, per event loop (httpx clients are bound to their loop)
+_clients = weakref.WeakKeyDictionary()  # {loop: {host: httpx.AsyncClient}}
+_clients_lock = Lock()
+
+
+def _get_client(url):
+    # Get (or create) the pooled client for this URL's host on the running loop
+    loop = asyncio.get_running_loop()
+    host = urlsplit(url).netloc
+    
+    with _clients_lock:
+        loop_clients = _clients.setdefault(loop, {})
+        client = loop_clients.get(host)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=get_setting('http', 'async_max_connections', 20),
+                max_keepalive_connections=get_setting('http', 'async_max_keepalive', 10)
+            )
+            # requests follows redirects by default - keep the same behaviour
+            client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+            loop_clients[host] = client
+        return client
+
+
+async def async_http_request(endpoint, method, url, **kwargs):
+    # Send a request over the pooled async client for the URL's host
+    # endpoint: key in DEFAULT_TIMEOUTS - picks the default timeout (capped by the request deadline)
+    kwargs['timeout'] = call_timeout(endpoint, kwargs.get('timeout'))
+    return await _get_client(url).request(method, url, **kwargs)
+
+
+async def close_clients():
+    # Close the clients opened on the running loop
+    loop = asyncio.get_running_loop()
+    
+    with _clients_lock:
+        loop_clients = _clients.pop(loop, {})
+    
+    for client in loop_clients.values():
+        await client.aclose()
+
+
+# ==================== REQUEST PLANS ====================
+
+def classify_error(error):
+    # httpx counterpart of api_requests.classify_error
+    # Returns: 'timeout', 'connection', 'request' (other HTTP client error) or 'other'
+    if isinstance(error, (httpx.TimeoutException, DeadlineExceeded)):
+        return 'timeout'
+    if isinstance(error, httpx.NetworkError):
+        return 'connection'
+    if isinstance(error, httpx.RequestError):
+        return 'request'
+    return 'other'
+
+
+async def async_execute_plan(plan):
+    # Run a request plan (see api_requests.execute_plan) over the pooled async clients
+    # Shares the per-host circuit breakers and latency windows with the sync path; uploads stay on the sync path
+    
+    if deadline_expired():
+        return plan['on_error']('timeout', DeadlineExceeded(f"request deadline passed before {plan['endpoint']} call"))
+    
+    breaker = get_circuit_breaker(plan['url'])
+    if not breaker.allow():
+        return plan['on_error']('connection', CircuitOpenError(f"{breaker.host} is unavailable (circuit open)"))
+    
+    start = time.monotonic()
+    try:
+        response = await async_http_request(plan['endpoint'], plan['method'], plan['url'], **plan.get('kwargs', {}))
+    except Exception as e:
+        kind = classify_error(e)
+        # A timeout cut short by our own deadline says nothing about the upstream
+        if deadline_expired():
+            record_outcome(breaker)
+        else:
+            record_outcome(breaker, kind=kind)
+            if kind == 'timeout':
+                record_latency(plan['endpoint'], time.monotonic() - start)
+        return plan['on_error'](kind, e)
+    
+    record_outcome(breaker, status_code=response.status_code)
+    record_latency(plan['endpoint'], time.monotonic() - start)
+    
+    try:
+        return plan['parse'](response)
+    except Exception as e:
+        return plan['on_error'](classify_error(e), e)
+
+
+# ==================== CHATGPT ====================
+
+async def async_chatgpt_send_message(message, gpt_chat_id=None):
+    # Send message to ChatGPT API and get response
+    # Args: message (str), gpt_chat_id (str, optional) - for conversation continuity
+    # Returns: dict with 'success', 'response', 'chat_id' or error details
+    return await async_execute_plan(_chatgpt_plan(message, gpt_chat_id))
+
+
+def chatgpt_send_message(message, gpt_chat_id=None):
+    # Sync wrapper for async_chatgpt_send_message
+    return run_coroutine(async_chatgpt_send_message(message, gpt_chat_id))
+
+
+# ==================== VIDEO DOWNLOADER ====================
+
+# Hedging: if an attempt hasn't answered by the endpoint's p90 latency, a second identical request
+# is sent and the first successful answer wins. Attempts are tasks on the shared loop, so they start as soon
+# as they are created and the hedge delay counts from the real start. Connection errors are retried with
+# full-jitter backoff.
+# Hedges and retries both spend from one budget that refills with normal traffic, so an outage
+# can't multiply the load on BatGPT (the circuit breaker stops retries once it opens).
+
+_video_settings = {
+    'hedging_enabled': get_setting('video_resolution', 'hedging_enabled', True),
+    'hedge_percentile': get_setting('video_resolution', 'hedge_percentile', 90),
+    'max_retries': get_setting('video_resolution', 'max_retries', 2),
+    'retry_base_delay_seconds': get_setting('video_resolution', 'retry_base_delay_seconds', 0.5),
+    'retry_max_delay_seconds': get_setting('video_resolution', 'retry_max_delay_seconds', 4),
+    'budget_ratio': get_setting('video_resolution', 'budget_ratio', 0.1),
+    'budget_max_tokens': get_setting('video_resolution', 'budget_max_tokens', 10),
+}
+
+
+class RetryBudget:
+    # Caps extra attempts (hedges + retries) at a fraction of normal traffic
+    # Every original call deposits ratio tokens (up to max_tokens); every extra attempt spends one
+    
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = Lock()
+    
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+    
+    def try_spend(self):
+        # True if an extra attempt is allowed (and takes a token)
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+_video_budget = RetryBudget(_video_settings['budget_ratio'], _video_settings['budget_max_tokens'])
+
+
+async def _hedged_video_attempt(url):
+    # One attempt, plus a hedge request if it is slower than the usual p90
+    hedge_delay = None
+    if _video_settings['hedging_enabled']:
+        hedge_delay = latency_percentile('video_download', _video_settings['hedge_percentile'])
+    
+    if hedge_delay is None:
+        return await async_execute_plan(_video_plan(url))
+    
+    first = asyncio.ensure_future(async_execute_plan(_video_plan(url)))
+    
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+    
+    if deadline_expired() or not _video_budget.try_spend():
+        return await first
+    
+    log_video_hedge(hedge_delay * 1000)
+    pending = {first, asyncio.ensure_future(async_execute_plan(_video_plan(url)))}
+    
+    # First success wins; if both fail, report the last failure
+    # (the loser is left to finish so its breaker and latency bookkeeping still happen)
+    result = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result = task.result()
+            if result.get('success'):
+                return result
+    return result
+
+
+async def async_video_download_request(url):
+    # Resolve a social media video URL with the BatGPT downloader (hedged, with jittered retries)
+    # Args: url (str) - social media video URL
+    # Returns: dict with 'success', 'media_url', 'title' or error details
+    
+    _video_budget.deposit()
+    attempt = 0
+    
+    while True:
+        result = await _hedged_video_attempt(url)
+        
+        if result.get('error_type') != 'connection_error' or attempt >= _video_settings['max_retries']:
+            return result
+        
+        # No point retrying into an open breaker
+        if get_circuit_breaker(BATGPT_DOWNLOADER_API).state == 'open':
+            return result
+        
+        # Full jitter: uniform between 0 and the capped exponential backoff
+        backoff = min(_video_settings['retry_max_delay_seconds'], _video_settings['retry_base_delay_seconds'] * 2 ** attempt)
+        delay = random.uniform(0, backoff)
+        
+        remaining = time_remaining()
+        if remaining is not None and remaining <= delay:
+            return result
+        
+        if not _video_budget.try_spend():
+            return result
+        
+        attempt += 1
+        log_video_retry(attempt, delay * 1000, result.get('error_type'))
+        await asyncio.sleep(delay)
+
+
+def video_download_request(url):
+    # Sync wrapper for async_video_download_request
+    return run_coroutine(async_video_download_request(url))
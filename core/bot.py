@@ -6,9 +6,10 @@ import os
 import time
 import re
 from difflib import get_close_matches
+from concurrent.futures import ThreadPoolExecutor
 
 # Import config and messages
-from config.config import get_prefix, is_admin
+from config.config import get_prefix, is_admin, get_setting
 from config.messages import get_message
 
 # Import logger
@@ -29,11 +30,16 @@ from commands.chatbot import (
 )
 from commands.video_downloader import (
     download_video,
-    get_supported_platforms,
-    extract_url
+    forget_resolved_video,
+    choose_delivery_path,
+    platform_status,
+    start_video_downloads,
+    extract_urls
 )
 from commands.whatsapp_tools import (
+    extract_phone_numbers,
     handle_checkwhatsapp,
+    handle_checkwhatsapp_bulk,
     handle_getavatar,
     handle_getcontactinfo
 )
@@ -48,11 +54,16 @@ from commands.admin import (
     handle_videoonly_selection
 )
 
-# Import Green API functions
-from core.api_requests import greenapi_send_message as send_message, greenapi_send_file_by_url as send_file_by_url, greenapi_send_file_by_upload as send_file_by_upload
+# Import Green API functions (queued sends - texts return immediately, file sends are awaited via Future)
+from core.api_requests import enqueue_send_message as send_message, enqueue_send_file_by_url as send_file_by_url, enqueue_send_file_by_upload as send_file_by_upload
+from core.api_requests import enqueue_forward_message as forward_message, media_relay_download, request_deadline, new_request_deadline
 
 # Import database functions
 from core.database import track_user, is_video_only_group, add_video_only_group, remove_video_only_group
+from core.database import get_delivered_media, save_delivered_media, delete_delivered_media
+
+# Long-running jobs (bulk checks) run one at a time off the webhook thread
+_bulk_jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-jobs')
 
 
 # Load commands configuration
@@ -240,7 +251,9 @@ def parse_message(message_text):
     tokens = command_part.split()
     
     # Reject if message is too long (more than 15 words likely not a command)
-    if len(tokens) > 15:
+    # URLs and number groups don't count, so bulk commands like ".short <url1> ... <url20>"
+    # or ".checkwa <list of numbers>" still parse
+    if sum(1 for token in tokens if 'http' not in token and not re.fullmatch(r'[\d+()\-.,;]+', token)) > 15:
         return None, None
     
     # Strategy: Try to match progressively GROWING prefixes (shortest to longest)
@@ -296,57 +309,167 @@ def handle_chatbot_command(chat_id, args):
 
 # Handle auto video download
 def handle_auto_download(chat_id, message_text, silent=False):
-    # Handle video download
+    # Handle video download - every link in the message is resolved in parallel,
+    # and videos go out in message order as soon as each one (and those before it) is ready
     # silent: If True, don't send confirmation messages (for video-only mode)
-    url = extract_url(message_text)
+    urls = extract_urls(message_text)
     
-    if not url:
+    if not urls:
         if not silent:
             send_message(chat_id, get_message("download_usage"))
         return
     
+    # Drop links to unsupported or currently failing sites locally, before any upstream call
+    supported = []
+    demoted = []
+    for url in urls:
+        domain, status = platform_status(url)
+        if status == 'supported':
+            supported.append(url)
+        elif status == 'demoted':
+            demoted.append(domain)
+    
+    if not supported:
+        if not silent:
+            if demoted:
+                send_message(chat_id, get_message("video_platform_unavailable", domain=demoted[0]))
+            else:
+                send_message(chat_id, get_message("video_unsupported_platform"))
+        return
+    urls = supported
+    
+    max_urls = get_setting('video_resolution', 'max_urls_per_message', 5)
+    skipped = max(len(urls) - max_urls, 0)
+    urls = urls[:max_urls]
+    
     if not silent:
         send_message(chat_id, get_message("downloading_video"))
+        if skipped:
+            send_message(chat_id, get_message("video_urls_skipped", skipped=skipped, max_urls=max_urls))
     
-    try:
-        result = download_video(url)
+    futures = start_video_downloads(urls)
+    
+    for url, future in zip(urls, futures):
+        try:
+            deliver_video(chat_id, url, future.result(), silent=silent, multiple=len(urls) > 1)
+        except Exception as e:
+            print(f"Error in auto download: {e}")
+            import traceback
+            traceback.print_exc()
+            if not silent:
+                send_download_failed(chat_id, url, multiple=len(urls) > 1)
+
+
+# Tell the chat a link couldn't be downloaded (names the link when the message had several)
+def send_download_failed(chat_id, url, multiple=False):
+    if multiple:
+        send_message(chat_id, get_message("video_download_failed_url", url=url))
+    else:
+        send_message(chat_id, get_message("video_download_failed"))
+
+
+# Send one resolved video (download_video result) to the chat
+# A cached resolution whose media URL turns out dead or unsendable is dropped and resolved once more (retry)
+def deliver_video(chat_id, url, result, silent=False, multiple=False, retry=True):
+    if not result or not result.get('success'):
+        if not silent:
+            send_download_failed(chat_id, url, multiple)
+        return
+    
+    video_url = result.get('media_url')
+    title = result.get('title', 'Video')
+    
+    if not video_url:
+        if not silent:
+            send_download_failed(chat_id, url, multiple)
+        return
+    
+    # Send video using Green API
+    caption = f"✅ {title}" if not silent else None
+    filename = "video.mp4"
+    
+    canonical_url = result.get('canonical_url')
+    response = forward_delivered_video(chat_id, canonical_url, has_caption=caption is not None)
+    
+    if not response:
+        # Pick URL send, relay upload or link-only up front from the file's size and type
+        path, size = choose_delivery_path(video_url)
         
-        if not result or not result.get('success'):
+        if path == 'gone':
+            forget_resolved_video(canonical_url)
+            if retry and result.get('cached'):
+                return deliver_video(chat_id, url, download_video(url), silent, multiple, retry=False)
             if not silent:
-                send_message(chat_id, get_message("video_download_failed"))
+                send_download_failed(chat_id, url, multiple)
             return
         
-        video_url = result.get('media_url')
-        title = result.get('title', 'Video')
-        
-        if not video_url:
+        if path == 'link':
             if not silent:
-                send_message(chat_id, get_message("video_download_failed"))
+                limit_mb = get_setting('video_delivery', 'max_file_mb', 100)
+                if size and size > limit_mb * 1024 * 1024:
+                    send_message(chat_id, get_message("video_too_large", size_mb=round(size / (1024 * 1024)), limit_mb=limit_mb, video_url=video_url))
+                else:
+                    send_message(chat_id, get_message("video_sent_fallback", video_url=video_url))
             return
         
-        # Send video using Green API
-        caption = f"✅ {title}" if not silent else None
-        filename = "video.mp4"
+        response = send_video(chat_id, canonical_url, video_url, filename, caption, relay=(path == 'upload'))
         
-        response = send_file_by_url(chat_id, video_url, filename, caption)
-        
-        if response:
-            # Video sent successfully - no log needed (already logged by logger)
-            pass
-        else:
-            # Fallback: send download link (only if not silent)
-            if not silent:
-                send_message(
-                    chat_id,
-                    get_message("video_sent_fallback", video_url=video_url)
-                )
-            
-    except Exception as e:
-        print(f"Error in auto download: {e}")
-        import traceback
-        traceback.print_exc()
+        if not response:
+            forget_resolved_video(canonical_url)
+            if retry and result.get('cached'):
+                return deliver_video(chat_id, url, download_video(url), silent, multiple, retry=False)
+    
+    if response:
+        # Video sent successfully - no log needed (already logged by logger)
+        pass
+    else:
+        # Fallback: send download link (only if not silent)
         if not silent:
-            send_message(chat_id, get_message("video_download_failed"))
+            send_message(
+                chat_id,
+                get_message("video_sent_fallback", video_url=video_url)
+            )
+
+
+# Forward an earlier delivery of the same video, if there is one with matching captioning
+def forward_delivered_video(chat_id, canonical_url, has_caption=False):
+    # A captioned delivery isn't forwarded to a silent request (and vice versa) - the caller sends fresh instead
+    # Returns: Green API response JSON, or None when there is nothing to forward or forwarding failed
+    max_age_days = get_setting('video_cache', 'forward_max_age_days', 7)
+    
+    if not canonical_url or not max_age_days:
+        return None
+    
+    delivered = get_delivered_media(canonical_url, max_age_days)
+    if not delivered or delivered['has_caption'] != has_caption:
+        return None
+    
+    response = forward_message(chat_id, delivered['chat_id'], delivered['id_message']).result()
+    if not response:
+        # Source message is gone (deleted, chat left) - caller falls back to a fresh send
+        delete_delivered_media(canonical_url)
+    return response
+
+
+# Send a resolved video by URL, or relay it through a local temp file
+def send_video(chat_id, canonical_url, video_url, filename, caption=None, relay=False):
+    # Returns: Green API response JSON or None if it couldn't be sent
+    if relay:
+        file_path = media_relay_download(video_url, suffix=os.path.splitext(filename)[1] or '.mp4')
+        if not file_path:
+            return None
+        try:
+            response = send_file_by_upload(chat_id, file_path, filename, caption).result()
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    else:
+        response = send_file_by_url(chat_id, video_url, filename, caption).result()
+    
+    if response and response.get('idMessage') and canonical_url:
+        save_delivered_media(canonical_url, chat_id, response['idMessage'], has_caption=caption is not None)
+    
+    return response
 
 
 # Handle ChatGPT message
@@ -370,24 +493,47 @@ def handle_dev_menu(chat_id):
 
 # Handle admin commands (now public)
 def handle_checkwhatsapp_command(chat_id, args):
+    numbers = extract_phone_numbers(args)
+    
+    # A pasted list can take minutes - check it off the webhook thread
+    if len(numbers) > 1:
+        _bulk_jobs.submit(run_checkwhatsapp_bulk, chat_id, numbers)
+        return
+    
     result = handle_checkwhatsapp(args)
     send_message(chat_id, result['message'])
 
 
+def run_checkwhatsapp_bulk(chat_id, numbers):
+    # Background bulk check with its own deadline - progress and the summary go through the send queue
+    deadline = new_request_deadline(get_setting('checkwa', 'bulk_deadline_seconds', 900))
+    
+    try:
+        with request_deadline(deadline):
+            result = handle_checkwhatsapp_bulk(numbers, on_progress=lambda message: send_message(chat_id, message))
+            send_message(chat_id, result['message'])
+    except Exception as e:
+        print(f"Error in bulk WhatsApp check: {e}")
+        import traceback
+        traceback.print_exc()
+
+
 def handle_getavatar_command(chat_id, args):
     result = handle_getavatar(args)
-    send_message(chat_id, result['message'])
+    avatar_file = result.get('file')
     
-    # If avatar file was downloaded, send it
-    if result.get('file_path'):
-        try:
-            import os
-            response = send_file_by_upload(chat_id, result['file_path'], 'avatar.jpg')
-            # Clean up temp file
-            if os.path.exists(result['file_path']):
-                os.remove(result['file_path'])
-        except Exception as e:
-            print(f"Error sending avatar file: {e}")
+    try:
+        send_message(chat_id, result['message'])
+        
+        # If the avatar was downloaded, upload it straight from memory
+        if avatar_file:
+            # Wait for the upload before closing the buffer it reads from
+            send_file_by_upload(chat_id, avatar_file, 'avatar.jpg').result()
+    except Exception as e:
+        print(f"Error sending avatar file: {e}")
+    finally:
+        if avatar_file:
+            avatar_file.close()
 
 
 def handle_getcontactinfo_command(chat_id, args):
@@ -444,7 +590,14 @@ def check_chatgpt_timeout(chat_id):
 
 
 # Main message handler
-def handle_incoming_message(chat_id, user_id, message_text, sender_name):
+def handle_incoming_message(chat_id, user_id, message_text, sender_name, deadline=None):
+    # deadline: absolute time.monotonic() budget for this webhook (from core/main.py)
+    # Every upstream call made while handling the message is capped by the time left
+    with request_deadline(deadline):
+        route_incoming_message(chat_id, user_id, message_text, sender_name)
+
+
+def route_incoming_message(chat_id, user_id, message_text, sender_name):
     # Log incoming message
     log_incoming_message(sender_name, chat_id, message_text)
     
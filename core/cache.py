@@ -0,0 +1,363 @@
+# In-Memory Caches
+# Thread-safe caches with bounded LRU eviction, shared by command modules
+# TTLCache (plain expiry), SingleFlight (request coalescing), SWRCache (stale-while-revalidate),
+# BlobCache (content-addressed bytes with a byte budget and optional disk tier)
+
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+
+class TTLCache:
+    # Key/value cache where entries expire ttl seconds after they were stored
+    # Least recently used entries are evicted once max_entries is reached
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {key: (value, stored_at)}
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        # Return the cached value, or default if missing or expired
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        # Store a value and evict the least recently used entries over the limit
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        # Remove a single entry if present
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        # Remove all entries
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key onto one in-flight call
+    # The first caller runs the function, everyone else waits for and shares its result
+
+    def __init__(self):
+        self._calls = {}  # {key: Future}
+        self._lock = Lock()
+        self.leaders = 0  # calls that ran fn()
+        self.joined = 0  # calls that waited on someone else's fn()
+
+    def do(self, key, fn):
+        # Run fn() once per key at a time and return its result to every concurrent caller
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.joined += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self):
+        # Coalescing counters for monitoring
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'joined': self.joined
+            }
+
+
+class SWRCache:
+    # Stale-while-revalidate cache
+    # - younger than fresh_ttl: returned immediately
+    # - younger than fresh_ttl + stale_ttl: returned immediately, refreshed in the background
+    # - older or missing: loaded inline, concurrent misses for one key share a single load
+    # should_cache(value) decides which loaded values are stored (e.g. skip error results)
+
+    def __init__(self, fresh_ttl, stale_ttl, max_entries=1000, should_cache=None):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.should_cache = should_cache or (lambda value: value is not None)
+        self._entries = OrderedDict()  # {key: (value, stored_at)}
+        self._refreshing = set()
+        self._lock = Lock()
+        self._flight = SingleFlight()
+
+    def get_or_load(self, key, loader):
+        # Return the value for key, calling loader() only on a miss or in a background refresh
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+
+                if age <= self.fresh_ttl:
+                    self._entries.move_to_end(key)
+                    return value
+
+                if age <= self.fresh_ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+                    return value
+
+                del self._entries[key]
+
+        return self._flight.do(key, lambda: self._load(key, loader))
+
+    def delete(self, key):
+        # Remove a single entry if present
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _load(self, key, loader):
+        # Call the loader and store the value if it should be cached
+        value = loader()
+        if self.should_cache(value):
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def _refresh(self, key, loader):
+        # Background refresh - a failed refresh keeps serving the stale value
+        try:
+            self._flight.do(key, lambda: self._load(key, loader))
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+class BlobCache:
+    # Content-addressed byte store: values are keyed by their SHA-256, so identical content is stored once
+    # Memory tier: LRU bounded by max_bytes in total; blobs larger than max_bytes are not cached
+    # Disk tier (optional, disk_dir set): one file per digest, expired by mtime after ttl, pruned oldest-first past disk_max_bytes (0 = no limit)
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, ttl, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # {digest: (data, stored_at)}
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data):
+        # Store data and return its digest
+        digest = self.digest(data)
+        self._put_memory(digest, data)
+        if self.disk_dir:
+            self._put_disk(digest, data)
+        return digest
+
+    def put_file(self, file, memory_max_bytes=None):
+        # Store the rest of a binary file (read from its current position) and return its digest
+        # Files up to memory_max_bytes (and the memory budget) are stored like put(); larger ones
+        # are hashed in chunks while streaming straight to the disk tier, never held in memory
+        # Returns: digest, or None if the file is empty or too large for memory with no disk tier
+        start = file.tell()
+        size = file.seek(0, os.SEEK_END) - start
+        file.seek(start)
+        if not size:
+            return None
+
+        memory_limit = self.max_bytes if memory_max_bytes is None else min(self.max_bytes, memory_max_bytes)
+        if size <= memory_limit:
+            return self.put(file.read())
+        if not self.disk_dir:
+            return None
+
+        hasher = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: file.read(self.CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    f.write(chunk)
+
+            digest = hasher.hexdigest()
+            path = self._disk_path(digest)
+            if os.path.exists(path):
+                os.utime(path)
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+                self._prune_disk()
+            return digest
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return None
+
+    def get(self, digest):
+        # Return the bytes for digest, or None if missing or expired in both tiers
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                data, stored_at = entry
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return data
+                self._drop(digest)
+
+        data = self._get_disk(digest) if self.disk_dir else None
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+
+        self._put_memory(digest, data)
+        return data
+
+    def stats(self):
+        # Size and hit counters for monitoring
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def _drop(self, digest):
+        # Caller holds the lock
+        data, _ = self._entries.pop(digest)
+        self._bytes -= len(data)
+
+    def _put_memory(self, digest, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (data, time.monotonic())
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _disk_path(self, digest):
+        return os.path.join(self.disk_dir, digest)
+
+    def _get_disk(self, digest):
+        path = self._disk_path(digest)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # The file name is the digest - a truncated or corrupted file is dropped rather than served
+        if self.digest(data) != digest:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return data
+
+    def _put_disk(self, digest, data):
+        path = self._disk_path(digest)
+        try:
+            if os.path.exists(path):
+                os.utime(path)
+                return
+
+            # Write to a temp file and rename, so readers never see a partial blob
+            fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, prefix='.tmp_')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self._prune_disk()
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        # Remove expired blobs, then the oldest ones until the tier fits in disk_max_bytes
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.is_file() or entry.name.startswith('.tmp_'):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                os.remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if not self.disk_max_bytes or total <= self.disk_max_bytes:
+                break
+            os.remove(path)
+            total -= size
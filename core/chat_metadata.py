@@ -0,0 +1,119 @@
+# Chat Metadata
+# Cached contact and group metadata (contact name / group subject, avatar flag) from Green API
+# Shared by quota-exceeded name resolution and .getcontactinfo
+# Failed or empty lookups are cached for a shorter negative TTL so an unknown chat isn't re-queried on every call
+# getGroupData has no avatar field - a group's avatar flag is fetched with getAvatar only when asked for, then cached
+
+from concurrent.futures import ThreadPoolExecutor
+
+from config.config import get_setting
+from core.api_requests import greenapi_get_contact_info, greenapi_get_group_data, greenapi_get_avatar, with_request_deadline
+from core.cache import TTLCache, SingleFlight
+
+_metadata = TTLCache(
+    ttl=get_setting('chat_metadata', 'ttl_seconds', 21600),
+    max_entries=get_setting('chat_metadata', 'max_entries', 2000)
+)
+_negative = TTLCache(
+    ttl=get_setting('chat_metadata', 'negative_ttl_seconds', 300),
+    max_entries=get_setting('chat_metadata', 'max_entries', 2000)
+)
+_flight = SingleFlight()
+_executor = ThreadPoolExecutor(
+    max_workers=get_setting('chat_metadata', 'batch_workers', 4),
+    thread_name_prefix='chat-metadata'
+)
+
+_MISS = object()
+
+
+def _fetch_metadata(chat_id):
+    # Look up one chat on Green API - getGroupData for groups, getContactInfo for contacts
+    # Returns: metadata dict or None if the lookup failed or came back empty
+    if chat_id.endswith('@g.us'):
+        data = greenapi_get_group_data(chat_id)
+        if not data:
+            return None
+        # has_avatar None = not looked up yet (see _with_avatar_flag)
+        return {'type': 'group', 'name': data.get('subject'), 'has_avatar': None}
+
+    data = greenapi_get_contact_info(chat_id)
+    if not data:
+        return None
+    return {'type': 'contact', 'name': data.get('name'), 'has_avatar': bool(data.get('avatar'))}
+
+
+def _load(chat_id):
+    metadata = _fetch_metadata(chat_id)
+    if metadata:
+        _metadata.set(chat_id, metadata)
+    else:
+        _negative.set(chat_id, True)
+    return metadata
+
+
+def _cached(chat_id):
+    # Returns: metadata dict, None for a negatively cached chat, or _MISS
+    metadata = _metadata.get(chat_id)
+    if metadata:
+        return metadata
+    if _negative.get(chat_id):
+        return None
+    return _MISS
+
+
+def _with_avatar_flag(chat_id, metadata):
+    # Fill in a group's has_avatar from getAvatar and cache it with the rest of the metadata
+    # Returns: metadata with has_avatar set (left None if getAvatar failed)
+    data = greenapi_get_avatar(chat_id)
+    if not data:
+        return metadata
+
+    metadata = {**metadata, 'has_avatar': bool(data.get('urlAvatar'))}
+    _metadata.set(chat_id, metadata)
+    return metadata
+
+
+def get_chat_metadata(chat_id, with_avatar=False):
+    # Metadata for one chat: {'type': 'contact'|'group', 'name', 'has_avatar'}
+    # with_avatar: look up a group's avatar flag too (otherwise has_avatar may be None for groups)
+    # Concurrent lookups of the same chat share one Green API call
+    # Returns: metadata dict or None if the chat couldn't be looked up
+    metadata = _cached(chat_id)
+    if metadata is _MISS:
+        metadata = _flight.do(chat_id, lambda: _load(chat_id))
+
+    if with_avatar and metadata and metadata['has_avatar'] is None:
+        metadata = _flight.do(('avatar', chat_id), lambda: _with_avatar_flag(chat_id, metadata))
+    return metadata
+
+
+def get_chat_metadata_batch(chat_ids):
+    # Metadata for several chats - cache misses are looked up concurrently
+    # Returns: {chat_id: metadata dict or None}, in input order without duplicates
+    results = {}
+    pending = {}
+
+    lookup = with_request_deadline(get_chat_metadata)
+    for chat_id in dict.fromkeys(chat_ids):
+        metadata = _cached(chat_id)
+        if metadata is _MISS:
+            pending[chat_id] = _executor.submit(lookup, chat_id)
+        results[chat_id] = metadata
+
+    for chat_id, future in pending.items():
+        try:
+            results[chat_id] = future.result()
+        except Exception:
+            results[chat_id] = None
+
+    return results
+
+
+def get_chat_metadata_stats():
+    # Cache sizes and lookup coalescing counters (for the health endpoint)
+    return {
+        'cached': len(_metadata),
+        'negative': len(_negative),
+        **_flight.stats()
+    }
@@ -1,9 +1,10 @@
 # Database Management using Turso (libSQL)
-# Handles: users, shortened links, video-only groups
+# Handles: users, shortened links, link mirror, delivered media, video-only groups
 
 import os
 import libsql_experimental as libsql
 from datetime import datetime
+from threading import RLock
 from core.logger import log_db_link_saved, log_db_link_query, log_db_link_found, log_db_reconnect, log_db_init, log_raw_request, log_raw_response
 
 # Get database credentials
@@ -13,6 +14,9 @@ TURSO_AUTH_TOKEN = os.getenv("TURSO_AUTH_TOKEN", "")
 # Database connection variable
 db = None
 
+# Serializes access to the shared connection (background sync threads use it too)
+_db_lock = RLock()
+
 def reconnect_db():
     # Reconnect to database when connection expires
     global db
@@ -42,15 +46,16 @@ def execute_with_retry(query, params=None, needs_commit=False, max_retries=2):
                     log_raw_response('Database', 'Connection failed', 'ERROR')
                     return None
             
-            # Execute query
-            if params:
-                result = db.execute(query, params)
-            else:
-                result = db.execute(query)
-            
-            # Commit if this is a write operation
-            if needs_commit:
-                db.commit()
+            with _db_lock:
+                # Execute query
+                if params:
+                    result = db.execute(query, params)
+                else:
+                    result = db.execute(query)
+                
+                # Commit if this is a write operation
+                if needs_commit:
+                    db.commit()
             
             # Log raw database response
             log_raw_response('Database', f'Query executed successfully | Commit: {needs_commit}', 'SUCCESS')
@@ -71,6 +76,46 @@ def execute_with_retry(query, params=None, needs_commit=False, max_retries=2):
     
     return None
 
+def execute_batch_with_retry(statements, max_retries=2):
+    # Execute several write statements and commit once (single transaction)
+    # statements: list of (query, params) tuples
+    # Returns: True on success, False if the database is unavailable
+    # Log raw database request (statement count only - batches can be large)
+    log_raw_request('Database', {'query': statements[0][0] if statements else '', 'statements': len(statements)})
+    
+    for attempt in range(max_retries):
+        try:
+            if not db:
+                if not reconnect_db():
+                    log_raw_response('Database', 'Connection failed', 'ERROR')
+                    return False
+            
+            with _db_lock:
+                for query, params in statements:
+                    db.execute(query, params)
+                
+                db.commit()
+            
+            log_raw_response('Database', f'Batch executed successfully | Statements: {len(statements)}', 'SUCCESS')
+            return True
+                
+        except ValueError as e:
+            error_msg = str(e)
+            # Uncommitted rows are dropped with the expired stream, so the whole batch is replayed
+            if "stream not found" in error_msg and attempt < max_retries - 1:
+                print(f"⚠️ Connection expired, reconnecting... (attempt {attempt + 1}/{max_retries})")
+                reconnect_db()
+                continue
+            else:
+                raise
+    
+    return False
+
+
+def execute_many_with_retry(query, params_list, max_retries=2):
+    # Execute the same write query for many rows and commit once (single transaction)
+    return execute_batch_with_retry([(query, params) for params in params_list], max_retries)
+
 # Create allowed_chats table if it doesn't exist
 def ensure_allowed_chats_table():
     if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
@@ -92,12 +137,93 @@ def ensure_allowed_chats_table():
         pass
 
 
+# Create link_mirror table if it doesn't exist
+# Local copy of ice.bio link metadata so listings don't need a bulk API download
+def ensure_link_mirror_table():
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return
+    
+    try:
+        execute_with_retry(
+            """
+            CREATE TABLE IF NOT EXISTS link_mirror (
+                link_id INTEGER PRIMARY KEY,
+                alias TEXT,
+                shorturl TEXT NOT NULL,
+                clicks INTEGER DEFAULT 0,
+                date TEXT,
+                synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            needs_commit=True
+        )
+    except Exception:
+        pass
+
+
+# Create link_fingerprints table if it doesn't exist
+# Maps (user, normalized URL + alias + password fingerprint) to an existing short link
+def ensure_link_fingerprints_table():
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return
+    
+    try:
+        execute_with_retry(
+            """
+            CREATE TABLE IF NOT EXISTS link_fingerprints (
+                user_chat_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                link_id TEXT NOT NULL,
+                short_url TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_chat_id, fingerprint)
+            )
+            """,
+            needs_commit=True
+        )
+    except Exception:
+        pass
+
+
+def ensure_delivered_media_table():
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return
+    
+    try:
+        execute_with_retry(
+            """
+            CREATE TABLE IF NOT EXISTS delivered_media (
+                canonical_url TEXT PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                id_message TEXT NOT NULL,
+                has_caption INTEGER NOT NULL DEFAULT 0,
+                delivered_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            needs_commit=True
+        )
+    except Exception:
+        pass
+    
+    # Tables created before has_caption existed (fails harmlessly once the column is there)
+    try:
+        execute_with_retry(
+            "ALTER TABLE delivered_media ADD COLUMN has_caption INTEGER NOT NULL DEFAULT 0",
+            needs_commit=True
+        )
+    except Exception:
+        pass
+
+
 # Initialize database connection on startup
 if TURSO_DATABASE_URL and TURSO_AUTH_TOKEN:
     try:
         db = libsql.connect(TURSO_DATABASE_URL, auth_token=TURSO_AUTH_TOKEN)  # type: ignore
         log_db_init(True)
         ensure_allowed_chats_table()
+        ensure_link_mirror_table()
+        ensure_link_fingerprints_table()
+        ensure_delivered_media_table()
     except Exception as e:
         log_db_init(False, e)
         db = None
@@ -202,6 +328,117 @@ def save_shortened_link(user_id, link_id, password=None):
         return False
 
 
+def get_link_by_fingerprint(user_id, fingerprint):
+    # Look up a link this user already created for the same URL, alias and password
+    # Returns: dict with 'link_id', 'short_url' or None
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return None
+    
+    try:
+        result = execute_with_retry(
+            """
+            SELECT link_id, short_url
+            FROM link_fingerprints
+            WHERE user_chat_id = ? AND fingerprint = ?
+            """,
+            (user_id, fingerprint)
+        )
+        if result:
+            rows = result.fetchall()
+            if rows:
+                return {
+                    'link_id': rows[0][0],
+                    'short_url': rows[0][1]
+                }
+        return None
+    except Exception as e:
+        print(f"Error looking up link fingerprint: {e}")
+        return None
+
+
+# Params: (user_chat_id, fingerprint, link_id, short_url)
+FINGERPRINT_UPSERT_QUERY = """
+    INSERT INTO link_fingerprints (user_chat_id, fingerprint, link_id, short_url)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_chat_id, fingerprint) DO UPDATE SET
+        link_id = excluded.link_id,
+        short_url = excluded.short_url
+"""
+
+
+def save_link_fingerprint(user_id, fingerprint, link_id, short_url):
+    # Remember which short link was created for this URL fingerprint
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return False
+    
+    try:
+        execute_with_retry(
+            FINGERPRINT_UPSERT_QUERY,
+            (user_id, fingerprint, str(link_id), short_url),
+            needs_commit=True
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving link fingerprint: {e}")
+        return False
+
+
+def get_links_by_fingerprints(user_id, fingerprints):
+    # Batch version of get_link_by_fingerprint (one query for a whole bulk request)
+    # Returns: dict mapping fingerprint to {'link_id', 'short_url'}
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN or not fingerprints:
+        return {}
+    
+    try:
+        placeholders = ', '.join('?' for _ in fingerprints)
+        result = execute_with_retry(
+            f"""
+            SELECT fingerprint, link_id, short_url
+            FROM link_fingerprints
+            WHERE user_chat_id = ? AND fingerprint IN ({placeholders})
+            """,
+            (user_id, *fingerprints)
+        )
+        if result:
+            return {row[0]: {'link_id': row[1], 'short_url': row[2]} for row in result.fetchall()}
+        return {}
+    except Exception as e:
+        print(f"Error looking up link fingerprints: {e}")
+        return {}
+
+
+def save_shortened_links_batch(user_id, links):
+    # Save a batch of newly created links in one transaction
+    # links: list of dicts with 'link_id', 'short_url', 'fingerprint'
+    # Writes shortened_links, link_fingerprints and link_mirror rows together
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN or not links:
+        return False
+    
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    statements = []
+    
+    for link in links:
+        link_id = str(link['link_id'])
+        statements.append((
+            "INSERT INTO shortened_links (user_chat_id, link_id, password) VALUES (?, ?, ?)",
+            (user_id, link_id, None)
+        ))
+        statements.append((FINGERPRINT_UPSERT_QUERY, (user_id, link['fingerprint'], link_id, link['short_url'])))
+        statements.append((MIRROR_UPSERT_QUERY, (int(link_id), '', link['short_url'], 0, created_at)))
+    
+    try:
+        saved = execute_batch_with_retry(statements)
+        if saved:
+            for link in links:
+                log_db_link_saved(link['link_id'], user_id)
+        return saved
+    except Exception as e:
+        print(f"❌ DATABASE ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def get_user_link_ids(user_id):
     # Get user's shortened link IDs with passwords
     # user_id should be the individual sender ID (@c.us format)
@@ -260,6 +497,233 @@ def get_all_link_ids():
         return []
 
 
+# ==================== LINK MIRROR ====================
+
+# Params: (link_id, alias, shorturl, clicks, date)
+MIRROR_UPSERT_QUERY = """
+    INSERT INTO link_mirror (link_id, alias, shorturl, clicks, date)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(link_id) DO UPDATE SET
+        alias = excluded.alias,
+        shorturl = excluded.shorturl,
+        clicks = excluded.clicks,
+        date = excluded.date,
+        synced_at = CURRENT_TIMESTAMP
+"""
+
+
+def _mirror_rows(links):
+    # MIRROR_UPSERT_QUERY params for ice.bio list entries (entries without an ID are skipped)
+    rows = []
+    for link in links:
+        if link.get('id') is None:
+            continue
+        rows.append((
+            int(link.get('id')),
+            link.get('alias') or '',
+            link.get('shorturl') or '',
+            int(link.get('clicks') or 0),
+            link.get('date') or ''
+        ))
+    return rows
+
+
+def upsert_mirrored_links(links):
+    # Insert or refresh ice.bio link metadata in the local mirror (one transaction)
+    # links: list of dicts in ice.bio list format ('id', 'alias', 'shorturl', 'clicks', 'date')
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return False
+    
+    rows = _mirror_rows(links)
+    if not rows:
+        return True
+    
+    try:
+        return execute_many_with_retry(MIRROR_UPSERT_QUERY, rows)
+    except Exception as e:
+        print(f"Error updating link mirror: {e}")
+        return False
+
+
+def replace_mirrored_links(links):
+    # Full-sweep write: upsert every listed link and delete mirror rows ice.bio no longer lists (one transaction)
+    # Fingerprints pointing at deleted links go in the same batch, so .short can't hand back a dead short URL
+    # Rows newer than the newest listed link are kept - they were created while the sweep was running
+    # Returns: True on success, False on error
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return False
+    
+    rows = _mirror_rows(links)
+    seen_ids = {row[0] for row in rows}
+    newest_id = max(seen_ids, default=0)
+    
+    try:
+        result = execute_with_retry("SELECT link_id FROM link_mirror WHERE link_id <= ?", (newest_id,))
+        mirrored_ids = {int(row[0]) for row in result.fetchall()} if result else set()
+        stale_ids = sorted(mirrored_ids - seen_ids)
+        
+        statements = [(MIRROR_UPSERT_QUERY, row) for row in rows]
+        for start in range(0, len(stale_ids), 500):
+            chunk = stale_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            statements.append((f"DELETE FROM link_mirror WHERE link_id IN ({placeholders})", tuple(chunk)))
+            # link_fingerprints stores link_id as TEXT
+            statements.append((f"DELETE FROM link_fingerprints WHERE link_id IN ({placeholders})", tuple(str(link_id) for link_id in chunk)))
+        
+        if not statements:
+            return True
+        return execute_batch_with_retry(statements)
+    except Exception as e:
+        print(f"Error replacing link mirror: {e}")
+        return False
+
+
+def get_link_mirror_max_id():
+    # Get the newest link ID in the mirror (0 when empty)
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return 0
+    try:
+        result = execute_with_retry("SELECT MAX(link_id) FROM link_mirror")
+        if result:
+            rows = result.fetchall()
+            if rows and rows[0][0] is not None:
+                return int(rows[0][0])
+        return 0
+    except Exception as e:
+        print(f"Error reading link mirror: {e}")
+        return 0
+
+
+def _mirror_row_to_link(row):
+    # Convert a link_mirror row to the same dict shape returned by the ice.bio list API
+    return {
+        'id': row[0],
+        'alias': row[1] or '',
+        'shorturl': row[2],
+        'clicks': row[3] or 0,
+        'date': row[4] or 'N/A'
+    }
+
+
+def get_user_mirrored_links(user_id):
+    # Get user's links from the local mirror, newest first
+    # Returns: list of link dicts (ice.bio list format) or None on error
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return None
+    try:
+        result = execute_with_retry(
+            """
+            SELECT m.link_id, m.alias, m.shorturl, m.clicks, m.date
+            FROM shortened_links s
+            JOIN link_mirror m ON m.link_id = CAST(s.link_id AS INTEGER)
+            WHERE s.user_chat_id = ?
+            ORDER BY m.link_id DESC
+            """,
+            (user_id,)
+        )
+        if result:
+            return [_mirror_row_to_link(row) for row in result.fetchall()]
+        return None
+    except Exception as e:
+        print(f"Error reading link mirror: {e}")
+        return None
+
+
+def get_all_mirrored_links():
+    # Get every tracked link from the local mirror, newest first (admin only)
+    # Returns: list of link dicts (ice.bio list format) or None on error
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return None
+    try:
+        result = execute_with_retry(
+            """
+            SELECT DISTINCT m.link_id, m.alias, m.shorturl, m.clicks, m.date
+            FROM shortened_links s
+            JOIN link_mirror m ON m.link_id = CAST(s.link_id AS INTEGER)
+            ORDER BY m.link_id DESC
+            """
+        )
+        if result:
+            return [_mirror_row_to_link(row) for row in result.fetchall()]
+        return None
+    except Exception as e:
+        print(f"Error reading link mirror: {e}")
+        return None
+
+
+# ==================== DELIVERED MEDIA ====================
+# Videos already sent once, by canonical source URL - later requests forward that message
+
+def save_delivered_media(canonical_url, chat_id, id_message, has_caption=False):
+    # Remember the message a video was delivered in and whether it carried a caption (latest delivery wins)
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return False
+    
+    try:
+        execute_with_retry(
+            """
+            INSERT INTO delivered_media (canonical_url, chat_id, id_message, has_caption)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(canonical_url) DO UPDATE SET
+                chat_id = excluded.chat_id,
+                id_message = excluded.id_message,
+                has_caption = excluded.has_caption,
+                delivered_at = CURRENT_TIMESTAMP
+            """,
+            (canonical_url, chat_id, id_message, 1 if has_caption else 0),
+            needs_commit=True
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving delivered media: {e}")
+        return False
+
+
+def get_delivered_media(canonical_url, max_age_days=7):
+    # Look up a recent delivery of this video
+    # Returns: dict with 'chat_id', 'id_message', 'has_caption' or None
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return None
+    
+    try:
+        result = execute_with_retry(
+            """
+            SELECT chat_id, id_message, has_caption
+            FROM delivered_media
+            WHERE canonical_url = ? AND delivered_at >= datetime('now', ?)
+            """,
+            (canonical_url, f'-{int(max_age_days)} days')
+        )
+        if result:
+            rows = result.fetchall()
+            if rows:
+                return {
+                    'chat_id': rows[0][0],
+                    'id_message': rows[0][1],
+                    'has_caption': bool(rows[0][2])
+                }
+        return None
+    except Exception as e:
+        print(f"Error looking up delivered media: {e}")
+        return None
+
+
+def delete_delivered_media(canonical_url):
+    # Forget a delivery that can no longer be forwarded
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return False
+    
+    try:
+        execute_with_retry(
+            "DELETE FROM delivered_media WHERE canonical_url = ?",
+            (canonical_url,),
+            needs_commit=True
+        )
+        return True
+    except Exception:
+        return False
+
+
 # ==================== VIDEO-ONLY MODE ====================
 
 def add_video_only_group(group_id, admin_chat_id):
@@ -0,0 +1,130 @@
+# Link Mirror Sync
+# Keeps the local link_mirror table in step with ice.bio in the background
+# Incremental sync pulls only links newer than the last seen ID; a periodic full sweep refreshes clicks
+# and removes links that were deleted on ice.bio
+
+import time
+from datetime import datetime
+from threading import Thread, Event, Lock
+
+from config.config import get_setting
+from core.api_requests import link_list_request
+from core.database import upsert_mirrored_links, replace_mirrored_links, get_link_mirror_max_id, TURSO_DATABASE_URL, TURSO_AUTH_TOKEN
+from core.logger import log_link_sync, log_link_sync_error
+
+# Sync state - mirror is only used for listings after one full sweep has completed
+_mirror_ready = Event()
+_sync_lock = Lock()
+_sync_thread = None
+_last_full_sync = 0
+
+
+def is_link_mirror_ready():
+    # True once the mirror holds a complete copy of the ice.bio link list
+    return _mirror_ready.is_set()
+
+
+def sync_link_mirror(full=False):
+    # Pull link metadata from ice.bio into the local mirror
+    # full=False: stop at the first page that reaches an already-mirrored link ID
+    # full=True: walk every page (backfill + clicks refresh) and drop links deleted on ice.bio
+    # Returns: number of links written, or None on error
+
+    page_size = get_setting('link_mirror', 'page_size', 100)
+
+    with _sync_lock:
+        start_time = time.perf_counter()
+        last_seen_id = 0 if full else get_link_mirror_max_id()
+
+        collected = []
+        page = 1
+
+        while True:
+            result = link_list_request(limit=page_size, page=page)
+
+            if not result.get('success'):
+                log_link_sync_error(result.get('error_message') or result.get('error') or result.get('error_type'))
+                return None
+
+            links = result.get('links', [])
+
+            if full:
+                collected.extend(links)
+            else:
+                # List is ordered newest first - keep only IDs we haven't seen yet
+                new_links = [link for link in links if int(link.get('id') or 0) > last_seen_id]
+                collected.extend(new_links)
+                if len(new_links) < len(links):
+                    break
+
+            # Short page means we reached the end of the list
+            if len(links) < page_size:
+                break
+
+            page += 1
+
+        # A full sweep saw the whole list, so links missing from it were deleted on ice.bio
+        if full:
+            written = replace_mirrored_links(collected)
+        else:
+            written = upsert_mirrored_links(collected) if collected else True
+
+        if not written:
+            log_link_sync_error('database write failed')
+            return None
+
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        log_link_sync(len(collected), 'full' if full else 'incremental', duration_ms)
+
+        if full:
+            _mirror_ready.set()
+
+        return len(collected)
+
+
+def mirror_new_link(link_id, short_url, custom_alias=None):
+    # Add a just-created link to the mirror so it shows in listings before the next sync
+    upsert_mirrored_links([{
+        'id': link_id,
+        'alias': custom_alias or '',
+        'shorturl': short_url,
+        'clicks': 0,
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }])
+
+
+def _sync_loop():
+    # Background loop: full sweep on start and every clicks_refresh_minutes, incremental in between
+    global _last_full_sync
+
+    while True:
+        interval = get_setting('link_mirror', 'sync_interval_seconds', 60)
+        refresh_minutes = get_setting('link_mirror', 'clicks_refresh_minutes', 10)
+
+        try:
+            if time.time() - _last_full_sync >= refresh_minutes * 60:
+                if sync_link_mirror(full=True) is not None:
+                    _last_full_sync = time.time()
+            else:
+                sync_link_mirror(full=False)
+        except Exception as e:
+            log_link_sync_error(e)
+
+        time.sleep(interval)
+
+
+def start_link_mirror_sync():
+    # Start the background sync thread (once per process)
+    global _sync_thread
+
+    if not TURSO_DATABASE_URL or not TURSO_AUTH_TOKEN:
+        return
+
+    if not get_setting('link_mirror', 'enabled', True):
+        return
+
+    if _sync_thread and _sync_thread.is_alive():
+        return
+
+    _sync_thread = Thread(target=_sync_loop, name='link-mirror-sync', daemon=True)
+    _sync_thread.start()
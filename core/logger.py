@@ -32,6 +32,10 @@ CONSOLE_MESSAGES = {
     'video_error_connection': "❌ Video Downloader → Connection failed: {error}",
     'video_error_json': "❌ Video Downloader → JSON parse error: {error}",
     'video_error_processing': "❌ Video Downloader → Processing error: {error}",
+    'video_hedge': "🔀 Video Downloader → No answer after {delay_ms:.0f}ms, sending hedge request",
+    'video_retry': "🔁 Video Downloader → Retry {attempt} in {delay_ms:.0f}ms after {error_type}",
+    'video_cache_hit': "⚡ Video Downloader → Cached: {title}",
+    'video_platform_demoted': "⚠️  Video Downloader → Demoting {domain} for {minutes} min | {success_pct:.0f}% success over {attempts} attempts",
     
     # ==================== LINK SHORTENER API ====================
     'link_shorten_request': "🔗 Link Shortener → Shortening: {url}",
@@ -47,15 +51,32 @@ CONSOLE_MESSAGES = {
     'link_error_connection': "❌ Link Shortener → Connection failed: {error}",
     'link_error_unexpected': "❌ Link Shortener → Unexpected error: {error}",
     
+    # ==================== LINK MIRROR SYNC ====================
+    'link_sync_done': "🔄 Link Mirror → Synced {count} links ({mode}) in {duration_ms:.0f}ms",
+    'link_sync_error': "⚠️  Link Mirror → Sync failed: {error}",
+    
     # ==================== GREEN API (WHATSAPP) ====================
     'greenapi_send_message': "📤 Green API → Sending message to {chat_id}",
     'greenapi_send_file_url': "📤 Green API → Sending file (URL) to {chat_id} | File: {filename}",
     'greenapi_send_file_upload': "📤 Green API → Sending file (Upload) to {chat_id} | File: {filename}",
+    'greenapi_send_forward': "📤 Green API → Forwarding message to {chat_id} | From: {chat_id_from}",
     'greenapi_send_poll': "📤 Green API → Sending poll to {chat_id}",
     'greenapi_send_location': "📤 Green API → Sending location to {chat_id}",
     'greenapi_send_contact': "📤 Green API → Sending contact to {chat_id}",
     'greenapi_response_success': "✅ Green API → Success | Message ID: {message_id}",
     'greenapi_response_failed': "❌ Green API → Failed to send",
+    'greenapi_send_latency': "⏱️  Green API → {operation} to {chat_id} | Queued {wait_ms:.0f}ms | Sent in {send_ms:.0f}ms",
+    'greenapi_send_latency_merged': "⏱️  Green API → {operation} to {chat_id} | Queued {wait_ms:.0f}ms | Sent in {send_ms:.0f}ms | Merged {merged} messages",
+    'greenapi_avatar_cache_hit': "⚡ Green API → Cached avatar for {chat_id} ({size_kb:.0f} KB)",
+    
+    # ==================== STREAMING UPLOADS ====================
+    'upload_progress': "⬆️  Upload → {filename} {percent}% | {sent_mb:.1f} MB | {mb_per_second:.2f} MB/s",
+    'upload_done': "⬆️  Upload → {filename} done | {size_mb:.1f} MB in {duration_ms:.0f}ms | {mb_per_second:.2f} MB/s",
+    
+    # ==================== CIRCUIT BREAKERS ====================
+    'circuit_open': "🔌 Circuit → {host} open after {failures} failures - failing fast",
+    'circuit_half_open': "🔌 Circuit → {host} half-open - sending probe",
+    'circuit_closed': "🔌 Circuit → {host} closed - upstream recovered",
     
     # ==================== RAW REQUEST/RESPONSE LOGGING ====================
     'raw_request': "📥 RAW REQUEST → {api_name}\n{payload}",
@@ -163,6 +184,26 @@ def log_video_error(error_type, **kwargs):
     log(f'video_error_{error_type}', **kwargs)
 
 
+def log_video_hedge(delay_ms):
+    # Log a hedge request sent because the first attempt was slower than usual
+    log('video_hedge', delay_ms=delay_ms)
+
+
+def log_video_retry(attempt, delay_ms, error_type):
+    # Log a jittered retry after a failed attempt
+    log('video_retry', attempt=attempt, delay_ms=delay_ms, error_type=error_type)
+
+
+def log_video_cache_hit(title):
+    # Log a video served from the resolved-media cache (no upstream call)
+    log('video_cache_hit', title=title)
+
+
+def log_video_platform_demoted(domain, success_rate, attempts, seconds):
+    # Log a platform host skipped for a while after its downloads kept failing
+    log('video_platform_demoted', domain=domain, success_pct=success_rate * 100, attempts=attempts, minutes=round(seconds / 60))
+
+
 # ==================== LINK SHORTENER API ====================
 
 def log_link_shorten_request(url):
@@ -202,11 +243,25 @@ def log_link_error(error_type, **kwargs):
     log(f'link_error_{error_type}', **kwargs)
 
 
+# ==================== LINK MIRROR SYNC ====================
+
+def log_link_sync(count, mode, duration_ms):
+    # Log a completed mirror sync (silent when nothing changed)
+    # mode: 'incremental' or 'full'
+    if count:
+        log('link_sync_done', count=count, mode=mode, duration_ms=duration_ms)
+
+
+def log_link_sync_error(error):
+    # Log a failed mirror sync
+    log('link_sync_error', error=str(error))
+
+
 # ==================== GREEN API (WHATSAPP) ====================
 
 def log_greenapi_send(operation, chat_id, **kwargs):
     # Log Green API send operations
-    # operation: 'message', 'file_url', 'file_upload', 'poll', 'location', 'contact'
+    # operation: 'message', 'file_url', 'file_upload', 'forward', 'poll', 'location', 'contact'
     # Show full chat ID (no truncation)
     log(f'greenapi_send_{operation}', chat_id=chat_id, **kwargs)
 
@@ -219,6 +274,40 @@ def log_greenapi_response(success, message_id=None):
         log('greenapi_response_failed')
 
 
+def log_greenapi_send_latency(operation, chat_id, wait_ms, send_ms, merged=1):
+    # Log per-send latency from the outbound queue
+    # operation: 'message', 'file_url', 'file_upload', 'forward'
+    if merged > 1:
+        log('greenapi_send_latency_merged', operation=operation, chat_id=chat_id, wait_ms=wait_ms, send_ms=send_ms, merged=merged)
+    else:
+        log('greenapi_send_latency', operation=operation, chat_id=chat_id, wait_ms=wait_ms, send_ms=send_ms)
+
+
+def log_greenapi_avatar_cache_hit(chat_id, size_bytes):
+    # Log an avatar served from the avatar cache (no getAvatar or CDN call)
+    log('greenapi_avatar_cache_hit', chat_id=chat_id, size_kb=size_bytes / 1024)
+
+
+# ==================== STREAMING UPLOADS ====================
+
+def log_upload_progress(filename, percent, bytes_sent, mb_per_second):
+    # Log an upload reaching a 25% step
+    log('upload_progress', filename=filename, percent=percent, sent_mb=bytes_sent / (1024 * 1024), mb_per_second=mb_per_second)
+
+
+def log_upload_done(filename, size_bytes, duration_ms, mb_per_second):
+    # Log a finished upload with its throughput
+    log('upload_done', filename=filename, size_mb=size_bytes / (1024 * 1024), duration_ms=duration_ms, mb_per_second=mb_per_second)
+
+
+# ==================== CIRCUIT BREAKERS ====================
+
+def log_circuit_state(host, state, **kwargs):
+    # Log a breaker state change
+    # state: 'open', 'half_open', 'closed'
+    log(f'circuit_{state}', host=host, **kwargs)
+
+
 # ==================== DATABASE OPERATIONS ====================
 
 def log_db_link_saved(link_id, user_chat_id):
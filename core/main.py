@@ -7,10 +7,14 @@ import re
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 from core.bot import handle_incoming_message
-from core.api_requests import greenapi_set_credentials, greenapi_get_settings, greenapi_get_group_data, greenapi_get_contact_info
+from core.api_requests import greenapi_set_credentials, greenapi_get_settings, get_connection_stats, get_send_queue_stats, get_circuit_breaker_states, get_timeout_stats, get_upload_stats, new_request_deadline
 from core.database import save_allowed_chats, get_allowed_chats
+from core.link_sync import start_link_mirror_sync
+from core.chat_metadata import get_chat_metadata_batch, get_chat_metadata_stats
+from commands.video_downloader import get_video_resolution_stats
+from commands.whatsapp_tools import get_avatar_cache_stats
 from core.logger import log_initialization, log_bot_ready, log_webhook, log_ignored, log_raw_request, log_raw_response, log_allowed_chats_display
-from config.config import set_admin_number
+from config.config import set_admin_number, get_setting
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +32,9 @@ instance_id = None
 token = None
 instance_ready = False  # Flag to ensure initialization is complete
 
+# Time budget for handling one webhook - kept under gunicorn's --timeout 120 so the worker isn't killed mid-request
+WEBHOOK_DEADLINE_SECONDS = get_setting('deadlines', 'webhook_seconds', 100)
+
 
 def normalize_user_id(user_id_raw):
     # Normalize user ID to consistent format for tracking and admin checks
@@ -79,6 +86,9 @@ def initialize_instance():
     if allowed_chats:
         log_allowed_chats_display(allowed_chats)
     
+    # Keep the local link mirror in sync with ice.bio (background thread)
+    start_link_mirror_sync()
+    
     log_bot_ready()
 
 
@@ -86,27 +96,19 @@ def initialize_instance():
 initialize_instance()
 
 
-# Helper function to get chat name from Green API
-def get_chat_name(chat_id):
-    # Get name for a contact or group
+# Helper function to get chat names from Green API
+def get_chat_names(chat_ids):
+    # Get names for contacts and groups (cached, misses looked up concurrently)
+    # Returns: {chat_id: name}, falling back to the chat ID when no name is known
     try:
-        # Check if it's a group (ends with @g.us)
-        if '@g.us' in chat_id:
-            # It's a group - get group data
-            group_data = greenapi_get_group_data(chat_id)
-            if group_data and group_data.get('subject'):
-                return group_data.get('subject')
-            else:
-                return chat_id
-        else:
-            # It's a contact - get contact info
-            contact_data = greenapi_get_contact_info(chat_id)
-            if contact_data and contact_data.get('name'):
-                return contact_data.get('name')
-            else:
-                return chat_id
+        metadata = get_chat_metadata_batch(chat_ids)
     except Exception:
-        return chat_id
+        metadata = {}
+    
+    return {
+        chat_id: (metadata.get(chat_id) or {}).get('name') or chat_id
+        for chat_id in chat_ids
+    }
 
 
 # Handle quota exceeded and save allowed chats
@@ -123,13 +125,13 @@ def handle_quota_exceeded(quota_data):
             print("⚠️  Quota exceeded but no chat IDs found in description")
             return
         
-        # Get names for each chat
+        # Get names for all chats in one batch
+        names = get_chat_names(chat_ids)
         chats_data = []
         for chat_id in chat_ids:
-            name = get_chat_name(chat_id)
             chats_data.append({
                 'chat_id': chat_id,
-                'name': name
+                'name': names[chat_id]
             })
         
         # Save to database (only updates if chats changed)
@@ -160,6 +162,9 @@ def webhook():
     # Handle incoming webhooks from Green API
     global own_number, instance_id, token
     
+    # Every upstream call made for this webhook shares one deadline
+    deadline = new_request_deadline(WEBHOOK_DEADLINE_SECONDS)
+    
     try:
         data = request.json
         
@@ -234,7 +239,7 @@ def webhook():
             
             if chat_id and message_text and user_id:
                 # Route to bot command handler with both chat_id (reply target) and user_id (tracking)
-                handle_incoming_message(chat_id, user_id, message_text, sender_name)
+                handle_incoming_message(chat_id, user_id, message_text, sender_name, deadline=deadline)
             else:
                 print(f"Missing required fields: chat_id={chat_id}, user_id={user_id}, message_text={'present' if message_text else 'missing'}")
         
@@ -267,7 +272,15 @@ def home():
         "status": "running",
         "bot": "SnapX WhatsApp Bot",
         "instance": instance_id[:6] + "..." if instance_id else "Not configured",
-        "endpoint": "/webhook"
+        "endpoint": "/webhook",
+        "connections": get_connection_stats(),
+        "send_queue": get_send_queue_stats(),
+        "circuit_breakers": get_circuit_breaker_states(),
+        "timeouts": get_timeout_stats(),
+        "video_resolution": get_video_resolution_stats(),
+        "uploads": get_upload_stats(),
+        "avatar_cache": get_avatar_cache_stats(),
+        "chat_metadata": get_chat_metadata_stats()
     })
 
 
@@ -0,0 +1,106 @@
+# Streaming Multipart Encoder
+# Builds a multipart/form-data body on the fly - the file is read in chunks as the socket asks for them,
+# so memory per upload stays constant whatever the file size (requests' files= builds the whole body first)
+
+import mimetypes
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+class MultipartFileEncoder:
+    # File-like multipart body: plain form fields followed by one file part
+    # requests: pass as data= with the content_type header (Content-Length comes from len())
+    # file: a path (opened and closed here) or a binary file object (read from its current position, left open)
+    # on_progress(bytes_sent, total_bytes) is called after every chunk handed to the socket
+
+    def __init__(self, fields, field_name, filename, file, on_progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.on_progress = on_progress
+        self.bytes_sent = 0
+
+        safe_filename = filename.replace('"', '%22')
+        file_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        head = b''.join(self._field_part(name, value) for name, value in fields.items())
+        head += (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_filename}"\r\n'
+            f"Content-Type: {file_type}\r\n\r\n"
+        ).encode('utf-8')
+        tail = f"\r\n--{self.boundary}--\r\n".encode('utf-8')
+
+        if isinstance(file, (str, os.PathLike)):
+            self._file = open(file, 'rb')
+            self._owns_file = True
+            file_size = os.path.getsize(file)
+        else:
+            self._file = file
+            self._owns_file = False
+            start = file.tell()
+            file_size = file.seek(0, os.SEEK_END) - start
+            file.seek(start)
+
+        self._total = len(head) + file_size + len(tail)
+        self._parts = [head, self._file, tail]  # bytes or an open file, sent in order
+        self._offset = 0  # position inside the current bytes part
+
+    def _field_part(self, name, value):
+        return (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode('utf-8')
+
+    def __len__(self):
+        return self._total
+
+    def read(self, size=CHUNK_SIZE):
+        # Return up to size bytes of the body (b'' when done)
+        # size < 0 reads one CHUNK_SIZE block rather than the whole body
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+
+        out = bytearray()
+        while len(out) < size and self._parts:
+            part = self._parts[0]
+
+            if isinstance(part, bytes):
+                piece = part[self._offset:self._offset + size - len(out)]
+                self._offset += len(piece)
+                if self._offset >= len(part):
+                    self._parts.pop(0)
+                    self._offset = 0
+            else:
+                piece = part.read(size - len(out))
+                if not piece:
+                    self._parts.pop(0)
+                    continue
+
+            out += piece
+
+        if out:
+            self.bytes_sent += len(out)
+            if self.on_progress:
+                self.on_progress(self.bytes_sent, self._total)
+
+        return bytes(out)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,180 @@
+# Phone Number Normalization
+# Validates and canonicalizes phone numbers locally, so impossible numbers never reach rate-limited Green API calls
+# Country calling codes are compiled into a digit trie (E.164 codes are prefix-free, so the first terminal node wins)
+# and each code carries the allowed length range of its national significant number
+#
+# Benchmark: python -m core.phone_numbers
+
+import re
+
+from config.config import get_setting
+
+# Country calling code -> (min, max) national significant number length (ITU-T E.164 national plans)
+COUNTRY_NUMBER_LENGTHS = {
+    '1': (10, 10), '7': (10, 10),
+    '20': (8, 10), '27': (9, 9), '30': (10, 10), '31': (9, 9), '32': (8, 9), '33': (9, 9), '34': (9, 9),
+    '36': (8, 9), '39': (6, 11), '40': (9, 9), '41': (9, 9), '43': (4, 13), '44': (9, 10), '45': (8, 8),
+    '46': (7, 10), '47': (8, 8), '48': (9, 9), '49': (6, 13), '51': (8, 9), '52': (10, 10), '53': (6, 8),
+    '54': (10, 11), '55': (10, 11), '56': (9, 9), '57': (8, 10), '58': (10, 10), '60': (8, 10), '61': (9, 9),
+    '62': (8, 12), '63': (8, 10), '64': (8, 10), '65': (8, 8), '66': (8, 9), '81': (9, 10), '82': (8, 10),
+    '84': (9, 10), '86': (10, 11), '90': (10, 10), '91': (10, 10), '92': (9, 10), '93': (9, 9), '94': (9, 9),
+    '95': (7, 10), '98': (10, 10),
+    '211': (9, 9), '212': (9, 9), '213': (8, 9), '216': (8, 8), '218': (8, 9), '220': (7, 7), '221': (9, 9),
+    '222': (8, 8), '223': (8, 8), '224': (8, 9), '225': (10, 10), '226': (8, 8), '227': (8, 8), '228': (8, 8),
+    '229': (8, 10), '230': (7, 8), '231': (7, 9), '232': (8, 8), '233': (9, 9), '234': (8, 10), '235': (8, 8),
+    '236': (8, 8), '237': (9, 9), '238': (7, 7), '239': (7, 7), '240': (9, 9), '241': (7, 8), '242': (9, 9),
+    '243': (9, 9), '244': (9, 9), '245': (7, 9), '246': (7, 7), '248': (7, 7), '249': (9, 9), '250': (9, 9),
+    '251': (9, 9), '252': (7, 9), '253': (8, 8), '254': (9, 10), '255': (9, 9), '256': (9, 9), '257': (8, 8),
+    '258': (8, 9), '260': (9, 9), '261': (9, 9), '262': (9, 9), '263': (9, 10), '264': (8, 9), '265': (7, 9),
+    '266': (8, 8), '267': (7, 8), '268': (8, 8), '269': (7, 7), '290': (4, 5), '291': (7, 7), '297': (7, 7),
+    '298': (6, 6), '299': (6, 6),
+    '350': (8, 8), '351': (9, 9), '352': (4, 11), '353': (7, 9), '354': (7, 9), '355': (8, 9), '356': (8, 8),
+    '357': (8, 8), '358': (5, 12), '359': (7, 9), '370': (8, 8), '371': (8, 8), '372': (7, 8), '373': (8, 8),
+    '374': (8, 8), '375': (9, 10), '376': (6, 9), '377': (8, 9), '378': (6, 10), '380': (9, 9), '381': (8, 12),
+    '382': (8, 8), '383': (8, 9), '385': (8, 9), '386': (8, 8), '387': (8, 9), '389': (8, 8), '420': (9, 9),
+    '421': (9, 9), '423': (7, 9),
+    '500': (5, 5), '501': (7, 7), '502': (8, 8), '503': (8, 8), '504': (8, 8), '505': (8, 8), '506': (8, 8),
+    '507': (7, 8), '508': (6, 6), '509': (8, 8), '590': (9, 9), '591': (8, 8), '592': (7, 7), '593': (8, 9),
+    '594': (9, 9), '595': (9, 9), '596': (9, 9), '597': (6, 7), '598': (8, 8), '599': (7, 8),
+    '670': (7, 8), '672': (6, 6), '673': (7, 7), '674': (7, 7), '675': (7, 8), '676': (5, 7), '677': (5, 7),
+    '678': (5, 7), '679': (7, 7), '680': (7, 7), '681': (6, 6), '682': (5, 5), '683': (4, 7), '685': (5, 7),
+    '686': (5, 8), '687': (6, 6), '688': (5, 6), '689': (6, 8), '690': (4, 7), '691': (7, 7), '692': (7, 7),
+    '850': (8, 10), '852': (8, 8), '853': (8, 8), '855': (8, 9), '856': (8, 10), '880': (10, 10), '886': (8, 9),
+    '960': (7, 7), '961': (7, 8), '962': (8, 9), '963': (8, 9), '964': (8, 10), '965': (8, 8), '966': (9, 9),
+    '967': (7, 9), '968': (8, 8), '970': (8, 9), '971': (8, 9), '972': (8, 9), '973': (8, 8), '974': (8, 8),
+    '975': (7, 8), '976': (8, 8), '977': (8, 10), '992': (9, 9), '993': (8, 8), '994': (9, 9), '995': (9, 9),
+    '996': (9, 9), '997': (10, 10), '998': (9, 9),
+}
+
+# National significant number length required for national form ("0" + NSN), where the dialling plan
+# fixes it more tightly than the international range above (PK mobiles: 0300 1234567 - 11 digits with the 0)
+NATIONAL_NUMBER_LENGTHS = {
+    '92': 10,
+}
+
+# Numbers written in national form (leading trunk 0) are read as this country's
+DEFAULT_COUNTRY_CODE = str(get_setting('phone', 'default_country_code', '92'))
+
+_NON_DIGITS = re.compile(r'\D')
+
+_COUNTRY_KEY = ''  # trie node key holding (country_code, min_length, max_length)
+
+
+def _compile_country_trie(lengths):
+    # Build {digit: {digit: ... {'': (code, min, max)}}} from the code table
+    root = {}
+    for code, (min_length, max_length) in lengths.items():
+        node = root
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node[_COUNTRY_KEY] = (code, min_length, max_length)
+    return root
+
+
+_COUNTRY_TRIE = _compile_country_trie(COUNTRY_NUMBER_LENGTHS)
+
+
+def match_country_code(digits):
+    # Longest (and only) country calling code at the start of an international number
+    # Returns: (country_code, min_length, max_length) or None
+    node = _COUNTRY_TRIE
+    for digit in digits[:3]:
+        node = node.get(digit)
+        if node is None:
+            return None
+        match = node.get(_COUNTRY_KEY)
+        if match:
+            return match
+    return None
+
+
+def _result(digits, error=None, country_code=None, national_number=None):
+    return {
+        'valid': error is None,
+        'number': country_code + national_number if error is None else None,
+        'country_code': country_code,
+        'national_number': national_number,
+        'digits': digits,
+        'error': error
+    }
+
+
+def normalize_phone_number(text, default_country_code=None):
+    # Validate a typed phone number and return it in international digits form ("923001234567")
+    # Accepts "+92 300 1234567", "0092...", "923001234567" and national "03001234567" (default country)
+    # Returns: dict with 'valid', 'number', 'country_code', 'national_number', 'digits', 'error'
+    #          error: 'empty', 'needs_country_code', 'unknown_country', 'too_short', 'too_long' or None
+    default_country_code = default_country_code or DEFAULT_COUNTRY_CODE
+    raw = (text or '').strip()
+    digits = _NON_DIGITS.sub('', raw)
+
+    if not digits:
+        return _result(digits, 'empty')
+
+    if raw.startswith('+'):
+        international = digits
+    elif digits.startswith('00'):
+        international = digits[2:]
+    elif digits.startswith('0'):
+        # National form - only meaningful for the default country
+        national_number = digits[1:]
+        min_length, max_length = COUNTRY_NUMBER_LENGTHS.get(default_country_code, (0, -1))
+        if default_country_code in NATIONAL_NUMBER_LENGTHS:
+            min_length = max_length = NATIONAL_NUMBER_LENGTHS[default_country_code]
+        if min_length <= len(national_number) <= max_length:
+            return _result(digits, None, default_country_code, national_number)
+        return _result(digits, 'needs_country_code')
+    else:
+        international = digits
+
+    match = match_country_code(international)
+    if not match:
+        return _result(digits, 'unknown_country')
+
+    country_code, min_length, max_length = match
+    national_number = international[len(country_code):]
+    if len(national_number) < min_length:
+        return _result(digits, 'too_short', country_code, national_number)
+    if len(national_number) > max_length:
+        return _result(digits, 'too_long', country_code, national_number)
+
+    return _result(digits, None, country_code, national_number)
+
+
+def benchmark(count=200000):
+    # Throughput of normalize_phone_number over a synthetic bulk list (valid, national, spaced and junk inputs)
+    import random
+    import time
+
+    # Spot checks before timing - national form for PK needs all 11 digits
+    assert normalize_phone_number('03001234567', '92')['number'] == '923001234567'
+    assert normalize_phone_number('0300123456', '92')['error'] == 'needs_country_code'
+    assert normalize_phone_number('+92 300 1234567')['number'] == '923001234567'
+    assert normalize_phone_number('0092 300 1234567')['number'] == '923001234567'
+
+    rng = random.Random(42)
+    samples = []
+    for _ in range(count):
+        kind = rng.randrange(5)
+        subscriber = ''.join(rng.choice('0123456789') for _ in range(7))
+        if kind == 0:
+            samples.append(f"92300{subscriber}")
+        elif kind == 1:
+            samples.append(f"0300{subscriber}")
+        elif kind == 2:
+            samples.append(f"+1 (415) {subscriber[:3]}-{subscriber[3:]}")
+        elif kind == 3:
+            samples.append(f"+44 7{subscriber}{rng.randrange(100):02d}")
+        else:
+            samples.append(subscriber[:rng.randrange(1, 8)])
+
+    start = time.perf_counter()
+    valid = sum(1 for sample in samples if normalize_phone_number(sample)['valid'])
+    elapsed = time.perf_counter() - start
+
+    print(f"normalize_phone_number: {count} numbers in {elapsed * 1000:.1f}ms "
+          f"({count / elapsed:,.0f}/s, {elapsed / count * 1e6:.2f}µs each) | {valid} valid")
+
+
+if __name__ == '__main__':
+    benchmark()